@@ -0,0 +1,42 @@
+from collections import Counter
+
+from instrumentation import stage
+from parallel import REDUCTIONS, parallel_groupby
+
+# Dimensions the dashboard segments users by
+SEGMENT_KEYS = ['Age Range', 'Gender', 'Platform', 'Dominant_Emotion']
+
+
+# Sum the metrics for every combination of keys that occurs in the data, dropping
+# combinations where every metric is zero. Only observed groups are built, so
+# categorical keys never expand into their full cartesian product, and the metrics
+# keep their numeric dtypes. Large frames are split over worker processes, as many as
+# workers or by default the number set with parallel.set_workers
+def aggregate_segments(df, metrics, keys=SEGMENT_KEYS, workers=None):
+    with stage('aggregate_segments', rows_in=len(df)) as rows:
+        named = {metric: (metric, 'sum') for metric in metrics}
+        agg = parallel_groupby(df, keys, named, workers).reset_index()
+        agg = agg[agg[metrics].ne(0).any(axis=1)]
+        rows.rows_out = len(agg)
+    return agg
+
+
+# Compute several metrics per group in a single groupby, given (column, reduction) pairs
+# such as ('Posts_Per_Day', 'sum') or ('Daily_Usage_Time (minutes)', 'mean'). The
+# keys are factorized once and every reduction runs over those groups, with no joins.
+# Result columns are named after their column, or column_reduction when one column is
+# reduced more than once. On large frames, reductions supported by parallel_groupby
+# are split over worker processes; others, such as mean, stay in-process
+def aggregate_metrics(df, metrics, keys='Platform', workers=None):
+    counts = Counter(column for column, _ in metrics)
+    named = {
+        column if counts[column] == 1 else f'{column}_{reduction}': (column, reduction)
+        for column, reduction in metrics
+    }
+    with stage('aggregate_metrics', rows_in=len(df)) as rows:
+        if all(reduction in REDUCTIONS for _, reduction in named.values()):
+            agg = parallel_groupby(df, keys, named, workers).reset_index()
+        else:
+            agg = df.groupby(keys, observed=True).agg(**named).reset_index()
+        rows.rows_out = len(agg)
+    return agg
@@ -0,0 +1,201 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from bucketing import age_buckets
+from cleaning import clean_social_media, correct_age_gender
+from cube import Cube
+from instrumentation import finish_run, start_run
+from loader import read_social_media
+
+# Define the absolute path to the CSV file
+csv_input_path = os.path.join(os.path.dirname(__file__), '../test.csv')
+
+# Seconds importing main may take on top of importing pandas, which the aggregate
+# command cannot avoid. The scheduler runs it thousands of times a day
+IMPORT_BUDGET_SECONDS = 0.15
+
+# Stages of a parallel cube build run in the calling process rather than the workers
+PARENT_STAGES = ['build_cube/parallel_groupby/share_columns', 'build_cube/parallel_groupby/combine']
+
+# Module sets whose cold import is timed, each in a fresh interpreter
+COLD_START_IMPORTS = {
+    'pandas': ['pandas'],
+    'main': ['main'],
+    'main + rendering': ['main', 'export', 'figures', 'reports'],
+}
+
+
+# Original row-by-row implementation, kept as the reference for the equivalence
+# tests in tests/test_cleaning.py and as the baseline timed here
+def legacy_correct_age_gender(df, age_col='Age', gender_col='Gender'):
+    def correct_row(row):
+        age, gender = row[age_col], row[gender_col]
+
+        try:
+            age = int(age)
+        except (ValueError, TypeError):
+            pass
+
+        if isinstance(age, int) and (0 <= age <= 120):
+            return age, gender
+
+        try:
+            potential_age = int(gender)
+            if 0 <= potential_age <= 120:
+                return potential_age, age
+        except (ValueError, TypeError):
+            pass
+
+        return row[age_col], row[gender_col]
+
+    df[age_col], df[gender_col] = zip(*df.apply(correct_row, axis=1))
+    return df
+
+
+# Time a function on a fresh copy of the DataFrame, returning seconds and the result
+def timed(func, df):
+    df = df.copy()
+    start = time.perf_counter()
+    result = func(df)
+    return time.perf_counter() - start, result
+
+
+# Build a frame of the requested size by resampling the sample export,
+# sprinkling in swapped, out-of-range and malformed Age/Gender values
+def make_frame(rows, seed=0):
+    base = pd.read_csv(csv_input_path, encoding='utf-8')
+    rng = np.random.default_rng(seed)
+    df = base.sample(n=rows, replace=True, random_state=seed).reset_index(drop=True)
+
+    age = df['Age'].to_numpy(dtype=object, copy=True)
+    gender = df['Gender'].to_numpy(dtype=object, copy=True)
+    swapped = rng.random(rows) < 0.05
+    age[swapped], gender[swapped] = gender[swapped], age[swapped].copy()
+    age[rng.random(rows) < 0.01] = '150'
+    age[rng.random(rows) < 0.01] = ' 42 '
+    gender[rng.random(rows) < 0.01] = '27.5'
+    df['Age'] = age
+    df['Gender'] = gender
+    return df
+
+
+# Row-wise against vectorized correction. tests/test_cleaning.py checks they agree
+def bench_correct_age_gender(args):
+    print(f"{'rows':>10} {'row-wise (s)':>14} {'vectorized (s)':>15} {'speedup':>9}")
+    for rows in args.sizes:
+        df = make_frame(rows)
+        vectorized, _ = timed(correct_age_gender, df)
+        if rows <= args.legacy_limit:
+            legacy, _ = timed(legacy_correct_age_gender, df)
+            print(f'{rows:>10} {legacy:>14.3f} {vectorized:>15.3f} {legacy / vectorized:>8.1f}x')
+        else:
+            print(f"{rows:>10} {'skipped':>14} {vectorized:>15.3f} {'-':>9}")
+
+
+# Time both CSV backends on files laid out like the export, with a blank line after every record
+def bench_parsers(args):
+    print(f"{'rows':>10} {'pandas (s)':>12} {'pyarrow (s)':>12} {'speedup':>9}")
+    for rows in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'export.csv')
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write(make_frame(rows).to_csv(index=False, lineterminator='\r\n\r\n'))
+
+            start = time.perf_counter()
+            expected = read_social_media(path, backend='pandas')
+            pandas_time = time.perf_counter() - start
+            start = time.perf_counter()
+            result = read_social_media(path, backend='pyarrow')
+            arrow_time = time.perf_counter() - start
+
+        pd.testing.assert_frame_equal(result, expected)
+        print(f'{rows:>10} {pandas_time:>12.3f} {arrow_time:>12.3f} {pandas_time / arrow_time:>8.1f}x')
+
+
+# Parallel cube builds against the serial one. 'parent (s)' is the work the parallel
+# path still does in the calling process, sharing the columns and combining the
+# partial results, which bounds its speedup however many workers there are
+def bench_parallel_groupby(args):
+    print(f"{'rows':>10} {'workers':>8} {'time (s)':>10} {'speedup':>9} {'parent (s)':>11}")
+    for rows in args.sizes:
+        df = clean_social_media(make_frame(rows))
+        df['Age Range'] = age_buckets()(df['Age'])
+        expected, serial_time = None, None
+        for workers in args.workers:
+            start_run('benchmark', trace_memory=False)
+            start = time.perf_counter()
+            cells = Cube.build(df, workers=workers).cells
+            elapsed = time.perf_counter() - start
+            records = finish_run().records
+            parent = sum(records[path].wall_seconds for path in PARENT_STAGES if path in records)
+            if expected is None:
+                expected, serial_time = cells, elapsed
+            pd.testing.assert_frame_equal(cells, expected)
+            print(f'{rows:>10} {workers:>8} {elapsed:>10.3f} {serial_time / elapsed:>8.1f}x {parent:>11.3f}')
+
+
+# Run Python code in a fresh interpreter from this directory, returning what it prints
+def run_fresh(code):
+    return subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                          capture_output=True, text=True, check=True).stdout
+
+
+def import_seconds(modules):
+    return float(run_fresh(f'import time; start = time.perf_counter(); import {", ".join(modules)}; '
+                           'print(time.perf_counter() - start)'))
+
+
+def bench_cold_start(args):
+    print(f"{'imports':>18} {'median (s)':>11} {'min (s)':>9}")
+    medians = {}
+    for name, modules in COLD_START_IMPORTS.items():
+        seconds = [import_seconds(modules) for _ in range(args.import_runs)]
+        medians[name] = np.median(seconds)
+        print(f'{name:>18} {medians[name]:>11.3f} {min(seconds):>9.3f}')
+
+    # The aggregate command must never load the plotting stack
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'metrics.json')
+        loaded = run_fresh(f'import runpy, sys; sys.argv = ["main.py", "aggregate", "--output", {output!r}]; '
+                           'runpy.run_path("main.py", run_name="__main__"); '
+                           'print(sorted({name.split(".")[0] for name in sys.modules} & {"plotly", "kaleido"}))')
+    assert loaded.splitlines()[-1] == '[]', f'aggregate imported {loaded.splitlines()[-1]}'
+    print('aggregate: plotly and kaleido are not imported')
+
+    overhead = medians['main'] - medians['pandas']
+    print(f'main imports in {overhead:.3f}s on top of pandas, budget {IMPORT_BUDGET_SECONDS:.3f}s')
+    assert overhead <= IMPORT_BUDGET_SECONDS, 'main is over its import-time budget'
+
+
+BENCHMARKS = {
+    'correct_age_gender': bench_correct_age_gender,
+    'parsers': bench_parsers,
+    'parallel_groupby': bench_parallel_groupby,
+    'cold_start': bench_cold_start,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the social media cleaning steps')
+    parser.add_argument('benchmarks', nargs='*', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='Benchmarks to run, all of them by default')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10**5, 10**6, 10**7],
+                        help='Number of rows to benchmark')
+    parser.add_argument('--legacy-limit', type=int, default=10**7,
+                        help='Largest size the row-wise implementation is run on')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='Worker process counts to benchmark the parallel groupby with')
+    parser.add_argument('--import-runs', type=int, default=7,
+                        help='Fresh interpreters each cold import is timed in')
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        print(f'== {name}')
+        BENCHMARKS[name](args)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+
+# Bucketing of integer ages into labelled ranges. Buckets are half-open [lo, hi)
+# intervals like pd.cut(..., right=False); ages outside every bucket are missing.
+# Ages are bounded, so the bucket of every possible age is precomputed into a
+# lookup table and a column is bucketed with one gather instead of a binary
+# search per row
+class AgeBuckets:
+    def __init__(self, edges, labels):
+        if len(labels) != len(edges) - 1:
+            raise ValueError(f'Expected {len(edges) - 1} labels for {len(edges)} edges, got {len(labels)}')
+        if any(lo >= hi for lo, hi in zip(edges, edges[1:])):
+            raise ValueError('Bucket edges must be strictly increasing')
+        self.edges = list(edges)
+        self.labels = list(labels)
+        self.dtype = pd.CategoricalDtype(self.labels, ordered=True)
+
+        # One entry per age up to the last edge, and at least every uint8, plus a
+        # trailing -1 that out of range and missing ages are pointed at
+        size = max(self.edges[-1], 256)
+        self.lookup = np.full(size + 1, -1, dtype='int8' if len(labels) < 128 else 'int16')
+        for code, (lo, hi) in enumerate(zip(self.edges, self.edges[1:])):
+            self.lookup[max(lo, 0):max(hi, 0)] = code
+
+    # Lookup table indices for an age column; the sentinel for anything off the table
+    def _indices(self, ages):
+        size = len(self.lookup) - 1
+        if ages.dtype == 'uint8':
+            return ages.to_numpy()
+        if pd.api.types.is_integer_dtype(ages.dtype):
+            values = ages.to_numpy(dtype='int64', na_value=-1)
+        else:
+            # Fractional ages share the bucket of their integer part, as edges are integers
+            values = np.floor(pd.to_numeric(ages, errors='coerce').to_numpy(dtype='float64', na_value=np.nan))
+            values = np.nan_to_num(values, nan=-1, posinf=-1, neginf=-1)
+        inside = (values >= 0) & (values < size)
+        return np.where(inside, values, size).astype('intp')
+
+    # Bucket an age column, returning an ordered categorical with the scheme's labels
+    def __call__(self, ages):
+        codes = self.lookup[self._indices(ages)]
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=self.dtype), index=ages.index, name='Age Range')
+
+
+# Named bucket schemes. 'dashboard' is the scheme the dashboard was built with
+AGE_SCHEMES = {
+    'dashboard': AgeBuckets([0, 18, 30, 45, 60, 120], ['0-18', '19-30', '31-45', '46-60', '60+']),
+    'decades': AgeBuckets(list(range(0, 130, 10)), [f'{lo}-{lo + 9}' for lo in range(0, 120, 10)]),
+    'marketing': AgeBuckets([13, 18, 25, 35, 45, 55, 65, 120],
+                            ['13-17', '18-24', '25-34', '35-44', '45-54', '55-64', '65+']),
+}
+DEFAULT_AGE_SCHEME = 'dashboard'
+
+
+def age_buckets(scheme=DEFAULT_AGE_SCHEME):
+    if scheme not in AGE_SCHEMES:
+        raise ValueError(f'Unknown age scheme {scheme!r}, expected one of {", ".join(AGE_SCHEMES)}')
+    return AGE_SCHEMES[scheme]
@@ -0,0 +1,105 @@
+import glob
+import hashlib
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+# Directory holding the cached cleaned frames
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '.cache')
+
+# Bytes read at a time when hashing the input file
+HASH_CHUNK_SIZE = 1 << 20
+
+
+# Hash the contents of a file with BLAKE2b, reading it in chunks
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Digest of the input file, reusing the last one while the size and mtime are unchanged,
+# so an unchanged input is never read again
+def cached_file_digest(path, cache_dir=CACHE_DIR):
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, 'digests.json')
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    key = os.path.abspath(path)
+    entry = index.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['digest']
+
+    digest = file_digest(path)
+    index[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest}
+    os.makedirs(cache_dir, exist_ok=True)
+    atomic_write(index_path, lambda tmp: _write_json(tmp, index))
+    return digest
+
+
+def _write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+# Write through a temporary file and rename it, so readers never see a partial file
+def atomic_write(path, write):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Remove the files matching pattern other than keep. Processes sharing the cache
+# directory may remove the same files at the same time, so files already gone are skipped
+def remove_stale(pattern, keep):
+    for stale in glob.glob(pattern):
+        if stale != keep:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+
+# Path of the cached frame for a given input digest, cache name and cleaning version
+def cache_path(name, digest, version, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f'{name}-v{version}-{digest}.arrow')
+
+
+# Load the cleaned frame for csv_path from the cache, building and storing it with
+# build(csv_path) on a miss. Frames are stored as uncompressed Arrow IPC (Feather v2)
+# files so they can be memory-mapped without parsing. A frame that cannot be read,
+# e.g. removed by another process in the meantime, is a miss. Without pyarrow the
+# cache is skipped
+def load_cached(csv_path, build, name, version, cache_dir=CACHE_DIR):
+    if pa is None:
+        return build(csv_path)
+
+    digest = cached_file_digest(csv_path, cache_dir)
+    path = cache_path(name, digest, version, cache_dir)
+    try:
+        return feather.read_table(path, memory_map=True).to_pandas()
+    except (OSError, pa.ArrowInvalid):
+        pass
+
+    df = build(csv_path)
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    atomic_write(path, lambda tmp: feather.write_feather(table, tmp, compression='uncompressed'))
+
+    # Drop frames cached for older inputs or cleaning versions
+    remove_stale(os.path.join(cache_dir, f'{name}-v*.arrow'), path)
+    return df
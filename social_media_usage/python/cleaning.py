@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from normalization import CategoryNormalizer
+from schema import SOCIAL_MEDIA_SCHEMA
+from validation import REJECT, Check, IsInteger, NonNegative, NotNull, OneOf, Range, Validator
+
+# Valid age bounds used when deciding whether Age and Gender were swapped
+MIN_AGE = 0
+MAX_AGE = 120
+
+# Integer literal accepted by int() once surrounding whitespace is stripped
+INT_PATTERN = r'[+-]?\d+'
+
+# Assume valid genders are 'Male', 'Female', 'Other'
+VALID_GENDERS = ['Male', 'Female', 'Other']
+
+# Canonical spellings of the text columns. Unknown genders, including swapped-in
+# numbers and names, are bucketed as 'Other'; unknown platforms and emotions are kept
+VALID_PLATFORMS = ['Facebook', 'Instagram', 'LinkedIn', 'Snapchat', 'Telegram', 'Twitter', 'Whatsapp']
+VALID_EMOTIONS = ['Anger', 'Anxiety', 'Boredom', 'Happiness', 'Neutral', 'Sadness']
+GENDER_NORMALIZER = CategoryNormalizer(VALID_GENDERS, aliases={'Non-binary': 'Other'}, default='Other')
+PLATFORM_NORMALIZER = CategoryNormalizer(VALID_PLATFORMS)
+EMOTION_NORMALIZER = CategoryNormalizer(VALID_EMOTIONS)
+
+# Per-day counters summed by the dashboards
+COUNTERS = [
+    'Daily_Usage_Time (minutes)',
+    'Posts_Per_Day',
+    'Likes_Received_Per_Day',
+    'Comments_Received_Per_Day',
+    'Messages_Sent_Per_Day',
+]
+
+# Bump whenever the cleaning steps change, so cached cleaned frames are rebuilt
+CLEANING_VERSION = 6
+
+
+# Parse a column the way int() would, returning floats with NaN where int() fails.
+# Strings must be integer literals, numbers are truncated towards zero. Text columns
+# hold few distinct values, so each is parsed once and the results gathered onto the rows
+def _parse_int(series):
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        values = series.to_numpy(dtype='float64', na_value=np.nan)
+        return np.where(np.isfinite(values), np.trunc(values), np.nan)
+
+    codes, uniques = pd.factorize(series)
+    parsed = _parse_int_values(pd.Series(uniques, dtype=series.dtype if len(uniques) else object))
+    # Missing values have code -1, which picks the trailing NaN
+    return np.append(parsed, np.nan)[codes]
+
+
+def _parse_int_values(series):
+    try:
+        stripped = series.str.strip()
+    except AttributeError:
+        # No string values at all, only numbers and missing values
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        return np.where(np.isfinite(values), np.trunc(values), np.nan)
+
+    # Non-string elements of an object column come back as missing from the .str accessor
+    is_str = ~(stripped.isna().to_numpy() & series.notna().to_numpy())
+    is_literal = stripped.str.fullmatch(INT_PATTERN).fillna(False).astype(bool).to_numpy()
+
+    # Integer literals convert directly, which is much cheaper than pd.to_numeric on strings
+    from_str = stripped.where(is_literal, 'nan').to_numpy(dtype=object).astype('float64')
+    if is_str.all():
+        return from_str
+
+    from_other = pd.to_numeric(series.where(~is_str), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    from_other = np.where(np.isfinite(from_other), np.trunc(from_other), np.nan)
+    return np.where(is_str, from_str, from_other)
+
+
+# Build the values of a corrected column: integers where picked, original values elsewhere
+def _merge_column(original, ints, picked):
+    if picked.all():
+        return pd.Series(ints.astype('int64'), index=original.index)
+    if not picked.any():
+        return original
+
+    values = original.to_numpy(dtype=object, copy=True)
+    values[picked] = ints[picked].astype('int64').astype(object)
+    return pd.Series(values, index=original.index).infer_objects()
+
+
+# Function to correct swapped Age and Gender values.
+# Column-wise version of the old row-by-row apply: both columns are parsed once and
+# the swap is decided with boolean masks, keeping the same results and dtypes
+def correct_age_gender(df, age_col='Age', gender_col='Gender'):
+    age, gender = df[age_col], df[gender_col]
+    age_int = _parse_int(age)
+    gender_int = _parse_int(gender)
+
+    # Comparisons against NaN are False, so unparsable values are never valid
+    age_valid = (age_int >= MIN_AGE) & (age_int <= MAX_AGE)
+    swap = ~age_valid & (gender_int >= MIN_AGE) & (gender_int <= MAX_AGE)
+
+    # Age takes the parsed age when valid, the parsed gender when swapped
+    new_age_int = np.where(age_valid, age_int, gender_int)
+    new_age = _merge_column(age, new_age_int, age_valid | swap)
+
+    # Swapped rows move the age into Gender, parsed to int when int() accepted it
+    if swap.any():
+        new_gender = gender.to_numpy(dtype=object, copy=True)
+        age_parsed = swap & ~np.isnan(age_int)
+        new_gender[age_parsed] = age_int[age_parsed].astype('int64').astype(object)
+        age_raw = swap & np.isnan(age_int)
+        new_gender[age_raw] = age.to_numpy(dtype=object)[age_raw]
+        new_gender = pd.Series(new_gender, index=gender.index).infer_objects()
+    else:
+        new_gender = gender
+
+    df[age_col] = new_age
+    df[gender_col] = new_gender
+    return df
+
+
+def _age_valid(df):
+    age = _parse_int(df['Age'])
+    return (age >= MIN_AGE) & (age <= MAX_AGE)
+
+
+def _age_gender_swapped(df):
+    gender = _parse_int(df['Gender'])
+    return ~_age_valid(df) & (gender >= MIN_AGE) & (gender <= MAX_AGE)
+
+
+# Rules checked on the raw rows. Rows failing a reject rule can't be repaired and are
+# quarantined; warn rules count values the steps below rewrite, such as a swapped Age
+# and Gender, an unusable Age that becomes 0 or an unknown gender that becomes 'Other'
+SOCIAL_MEDIA_VALIDATOR = Validator(
+    [
+        NotNull('user_id_missing', 'User_ID', severity=REJECT),
+        IsInteger('user_id_not_integer', 'User_ID', severity=REJECT),
+        Check('age_gender_swapped', ['Age', 'Gender'], _age_gender_swapped),
+        Check('age_invalid', ['Age'], lambda df: ~_age_valid(df)),
+        OneOf('gender_unknown', 'Gender', VALID_GENDERS + ['Non-binary'], fold_values=True),
+        OneOf('platform_unknown', 'Platform', VALID_PLATFORMS, fold_values=True),
+        OneOf('emotion_unknown', 'Dominant_Emotion', VALID_EMOTIONS, fold_values=True),
+    ]
+    + [NotNull(f'{column}_missing', column) for column in COUNTERS]
+    + [IsInteger(f'{column}_not_integer', column, severity=REJECT) for column in COUNTERS]
+    + [NonNegative(f'{column}_negative', column, severity=REJECT) for column in COUNTERS]
+    + [
+        Range('usage_time_over_a_day', 'Daily_Usage_Time (minutes)', high=24 * 60, severity=REJECT),
+        Check('likes_without_posts', ['Likes_Received_Per_Day', 'Posts_Per_Day'],
+              lambda df: (_parse_int(df['Posts_Per_Day']) == 0) & (_parse_int(df['Likes_Received_Per_Day']) > 0)),
+    ]
+)
+
+
+# Apply the cleaning steps shared by the dashboard and the Dash app. Rows failing a
+# reject rule are dropped; pass a ValidationReport to collect violation counts and the
+# quarantined rows
+def clean_social_media(df, validation=None):
+    # Check the raw rows before any value is rewritten
+    with stage('validate', rows_in=len(df)) as rows:
+        result = SOCIAL_MEDIA_VALIDATOR.validate(df)
+        df = result.valid
+        if validation is not None:
+            validation.add(result)
+        rows.rows_out = len(df)
+
+    # Correct Age and Gender columns
+    with stage('correct_age_gender', rows_in=len(df)) as rows:
+        df = correct_age_gender(df)
+        rows.rows_out = len(df)
+
+    # Ensure Age column contains only numeric values and convert to int
+    with stage('coerce_age', rows_in=len(df)) as rows:
+        df['Age'] = pd.to_numeric(df['Age'], errors='coerce').fillna(0).astype(int)
+        rows.rows_out = len(df)
+
+    # Handle incorrect gender entries and fold the spelling of platforms and emotions
+    with stage('normalize_categories', rows_in=len(df)) as rows:
+        df['Gender'] = GENDER_NORMALIZER(df['Gender'])
+        df['Platform'] = PLATFORM_NORMALIZER(df['Platform'])
+        df['Dominant_Emotion'] = EMOTION_NORMALIZER(df['Dominant_Emotion'])
+        rows.rows_out = len(df)
+
+    # Narrow every column to its declared dtype
+    with stage('apply_schema', rows_in=len(df)) as rows:
+        df = SOCIAL_MEDIA_SCHEMA.apply(df)
+        rows.rows_out = len(df)
+    return df
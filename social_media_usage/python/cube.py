@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from aggregation import SEGMENT_KEYS
+from instrumentation import stage
+from parallel import parallel_groupby
+
+# Measures summed into every cell of the cube
+MEASURES = [
+    'Likes_Received_Per_Day',
+    'Messages_Sent_Per_Day',
+    'Posts_Per_Day',
+    'Comments_Received_Per_Day',
+    'Daily_Usage_Time (minutes)',
+]
+
+# Measures whose distribution is sketched per platform, for medians and tail quantiles
+DISTRIBUTION_COLUMNS = [
+    'Daily_Usage_Time (minutes)',
+    'Likes_Received_Per_Day',
+    'Messages_Sent_Per_Day',
+]
+
+# Extra per-cell columns: how many rows fell into the cell and their Age bounds
+ROW_COUNT = 'Row_Count'
+AGE_MIN = 'Age_Min'
+AGE_MAX = 'Age_Max'
+
+
+# Pre-aggregated cube over the segment dimensions. The raw rows are reduced once to
+# their finest grain, one cell per observed combination of dimensions, and every
+# roll-up, slice or total is answered from those cells
+class Cube:
+    def __init__(self, cells, dimensions, measures):
+        self.cells = cells
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+
+    # Build the cube from cleaned rows. Rows with a missing dimension get their own
+    # cell, so totals over the cube match totals over the rows. Large frames are split over
+    # worker processes, as many as workers or by default the number set with parallel.set_workers
+    @classmethod
+    def build(cls, df, dimensions=SEGMENT_KEYS, measures=MEASURES, workers=None):
+        named = {measure: (measure, 'sum') for measure in measures}
+        named[ROW_COUNT] = (measures[0], 'size')
+        named[AGE_MIN] = ('Age', 'min')
+        named[AGE_MAX] = ('Age', 'max')
+        with stage('build_cube', rows_in=len(df)) as rows:
+            cells = parallel_groupby(df, list(dimensions), named, workers, dropna=False).reset_index()
+            rows.rows_out = len(cells)
+        return cls(cells, dimensions, measures)
+
+    # How each cell column combines when cells are rolled up
+    def _reductions(self):
+        reductions = {measure: 'sum' for measure in self.measures}
+        reductions.update({ROW_COUNT: 'sum', AGE_MIN: 'min', AGE_MAX: 'max'})
+        return reductions
+
+    # Combine with a cube over other rows, as if both had been built from all the rows
+    def merge(self, other):
+        with stage('merge_cube', rows_in=len(self.cells) + len(other.cells)) as rows:
+            cells = pd.concat([self.cells, other.cells], ignore_index=True)
+            cells = cells.groupby(self.dimensions, observed=True, dropna=False).agg(self._reductions()).reset_index()
+            rows.rows_out = len(cells)
+        return Cube(cells, self.dimensions, self.measures)
+
+    # Cube restricted to cells matching filters, a dict of dimension -> value or list of values
+    def slice(self, filters):
+        mask = np.ones(len(self.cells), dtype=bool)
+        for dimension, values in filters.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            mask &= self.cells[dimension].isin(values).to_numpy()
+        return Cube(self.cells[mask], self.dimensions, self.measures)
+
+    # Aggregate the cells up to the given dimensions, like a groupby on the raw rows.
+    # Groups with a missing key are dropped, as pandas does by default
+    def rollup(self, dimensions, columns=None):
+        reductions = self._reductions()
+        if columns is not None:
+            reductions = {column: reductions[column] for column in columns}
+        with stage('rollup', rows_in=len(self.cells)) as rows:
+            agg = self.cells.groupby(list(dimensions), observed=True).agg(reductions).reset_index()
+            rows.rows_out = len(agg)
+        return agg
+
+    # Grand totals over every cell, including those with missing dimensions. The cells
+    # are few, so plain numpy reductions beat going through DataFrame.agg
+    def totals(self):
+        reducers = {'sum': np.sum, 'min': np.min, 'max': np.max}
+        totals = {}
+        for column, reduction in self._reductions().items():
+            values = self.cells[column].to_numpy()
+            totals[column] = reducers[reduction](values) if len(values) else None
+        return pd.Series(totals, dtype=object)
+
+    # Number of distinct non-missing members of a dimension
+    def distinct(self, dimension):
+        return self.cells[dimension].nunique()
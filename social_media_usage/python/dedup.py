@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# Columns identifying a row: a user is only counted once, whatever else changed
+DEFAULT_KEYS = ['User_ID']
+
+# Reasons recorded for dropped rows
+REPEATED = 'repeated in batch'
+SEEN = 'seen before'
+
+
+# Rows a batch lost to de-duplication: their key columns and why each was dropped
+class DedupReport:
+    def __init__(self, keys, rows_in, dropped):
+        self.keys = keys
+        self.rows_in = rows_in
+        self.dropped = dropped
+
+    @property
+    def rows_out(self):
+        return self.rows_in - len(self.dropped)
+
+    # Report over this batch and a later one
+    def combine(self, other):
+        dropped = pd.concat([self.dropped, other.dropped], ignore_index=True)
+        return DedupReport(self.keys, self.rows_in + other.rows_in, dropped)
+
+
+def format_dedup_report(report):
+    counts = report.dropped['Reason'].value_counts()
+    details = ', '.join(f'{count} {reason}' for reason, count in counts.items())
+    keys = ', '.join(report.keys) if report.keys else 'all columns'
+    return f"Dropped {len(report.dropped)} of {report.rows_in} rows with duplicate {keys}" + (
+        f" ({details})" if details else '')
+
+
+# Keys of every row kept so far, so rows whose key was already seen, in this batch
+# or an earlier one, are dropped like drop_duplicates(subset=keys) over all batches.
+# Keys are kept as a sorted uint64 array: a single integer key column is stored as
+# is, anything else as a hash of the key columns. Checking a batch costs a binary
+# search per new row, however many rows were seen before
+class DedupStore:
+    def __init__(self, keys=DEFAULT_KEYS):
+        self.keys = list(keys) if keys is not None else None
+        self.seen = np.empty(0, dtype='uint64')
+        self.rows_dropped = 0
+
+    def _key_values(self, df):
+        columns = df[self.keys] if self.keys is not None else df
+        if len(columns.columns) == 1:
+            column = columns.iloc[:, 0]
+            if pd.api.types.is_integer_dtype(column.dtype) and not column.hasnans:
+                return column.to_numpy().astype('uint64')
+        return pd.util.hash_pandas_object(columns, index=False).to_numpy()
+
+    # Mask of the rows of df to keep, their keys and the report of the dropped rows
+    def _check(self, df):
+        values = self._key_values(df)
+        repeated = pd.Series(values).duplicated().to_numpy()
+        position = np.searchsorted(self.seen, values)
+        seen = position < len(self.seen)
+        seen[seen] = self.seen[position[seen]] == values[seen]
+        keep = ~repeated & ~seen
+
+        dropped = df.loc[~keep, self.keys if self.keys is not None else df.columns].reset_index(drop=True)
+        dropped['Reason'] = np.where(seen[~keep], SEEN, REPEATED)
+        return keep, values[keep], DedupReport(self.keys, len(df), dropped)
+
+    # Rows of df whose key was not seen yet, remembering their keys
+    def add(self, df):
+        keep, values, report = self._check(df)
+        self.seen = np.union1d(self.seen, values)
+        self.rows_dropped += len(report.dropped)
+        return df[keep], report
+
+    # Rows of df whose key was not seen yet, without remembering them
+    def peek(self, df):
+        keep, _, report = self._check(df)
+        return df[keep], report
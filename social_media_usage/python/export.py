@@ -0,0 +1,117 @@
+import os
+import time
+
+import plotly.io as pio
+
+from cache import atomic_write
+from instrumentation import stage
+
+FORMATS = ['pdf', 'png', 'svg', 'jpg', 'jpeg', 'webp']
+
+
+# One image to render: a figure (object or dict), the file to write and the format
+# and size to render it at. The format defaults to the file extension
+class ExportJob:
+    def __init__(self, figure, path, format=None, width=None, height=None, scale=None):
+        format = format or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in FORMATS:
+            raise ValueError(f'Unknown image format {format!r}, expected one of {", ".join(FORMATS)}')
+        self.figure = figure
+        self.path = path
+        self.format = format
+        self.width = width
+        self.height = height
+        self.scale = scale
+
+
+# How long a job took and how large the written file is
+class ExportResult:
+    def __init__(self, job, seconds, size):
+        self.job = job
+        self.seconds = seconds
+        self.size = size
+
+
+def format_export_report(results):
+    lines = []
+    for result in results:
+        job = result.job
+        size = f'{job.width}x{job.height}' if job.width or job.height else 'default size'
+        lines.append(f'{job.path} ({job.format}, {size}): {result.seconds:.3f}s, {result.size} bytes')
+    return '\n'.join(lines)
+
+
+# Start the headless renderer once and return a function that stops it. Kaleido 1.x
+# renders through a browser that plotly.io only keeps alive while a sync server runs;
+# Kaleido 0.2 already keeps one renderer process for the life of the Python process
+def _start_renderer():
+    import kaleido
+
+    if hasattr(kaleido, 'start_sync_server'):
+        kaleido.start_sync_server(silence_warnings=True)
+        return lambda: kaleido.stop_sync_server(silence_warnings=True)
+    return lambda: None
+
+
+# Session keeping one renderer alive for a batch of exports:
+#
+#     with ExportSession() as session:
+#         results = session.export_all(jobs)
+#
+# Every job reuses the renderer, so only the first pays its start-up cost
+class ExportSession:
+    def __init__(self):
+        self._stop = None
+
+    def __enter__(self):
+        with stage('start_renderer'):
+            self._stop = _start_renderer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop()
+        self._stop = None
+
+    # Render one job, writing the file atomically, and time it
+    def export(self, job):
+        start = time.perf_counter()
+        with stage(f'export_{job.format}'):
+            image = pio.to_image(job.figure, format=job.format, width=job.width, height=job.height,
+                                 scale=job.scale, validate=False)
+
+            def write(tmp):
+                with open(tmp, 'wb') as f:
+                    f.write(image)
+
+            atomic_write(job.path, write)
+        return ExportResult(job, time.perf_counter() - start, len(image))
+
+    def export_all(self, jobs):
+        return [self.export(job) for job in jobs]
+
+
+# Render a batch of jobs in a single renderer session
+def export_batch(jobs):
+    with ExportSession() as session:
+        return session.export_all(jobs)
+
+
+# Parse FORMAT or FORMAT:WIDTHxHEIGHT, e.g. 'svg' or 'png:1600x1200'
+def parse_export_spec(spec):
+    format, _, size = spec.partition(':')
+    format = format.lower()
+    if format not in FORMATS:
+        raise ValueError(f'Unknown image format {format!r}, expected one of {", ".join(FORMATS)}')
+    if not size:
+        return format, None, None
+    width, _, height = size.partition('x')
+    if not (width.isdigit() and height.isdigit()):
+        raise ValueError(f'Expected a size like 1600x1200, got {size!r}')
+    return format, int(width), int(height)
+
+
+# Output path for a figure exported in a format and size, next to base_path
+def export_path(base_path, format, width=None, height=None):
+    stem = os.path.splitext(base_path)[0]
+    suffix = f'-{width}x{height}' if width or height else ''
+    return f'{stem}{suffix}.{format}'
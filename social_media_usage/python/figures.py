@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import plotly
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from cache import CACHE_DIR, atomic_write, remove_stale
+from instrumentation import stage
+
+# Bump whenever a figure builder changes, so cached figures are rebuilt
+FIGURE_VERSION = 1
+
+# Figures already loaded or built by this process, by fingerprint
+_figures = {}
+
+
+# Feed a figure input into the digest. Frames and series are hashed by content, along
+# with their columns and dtypes; containers recursively; anything else by its repr
+def _update(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        columns = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        dtypes = value.dtypes.astype(str).tolist() if isinstance(value, pd.DataFrame) else [str(value.dtype)]
+        digest.update(repr((type(value).__name__, columns, dtypes, list(value.index.names))).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, dict):
+        digest.update(b'{')
+        for key in sorted(value, key=repr):
+            _update(digest, key)
+            _update(digest, value[key])
+        digest.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            _update(digest, item)
+        digest.update(b']')
+    else:
+        digest.update(repr(value).encode())
+    digest.update(b'\0')
+
+
+# Fingerprint of a figure: its name, the inputs and layout parameters it is built
+# from, the builder version and the plotly version that serializes it
+def figure_fingerprint(name, inputs, params):
+    digest = hashlib.blake2b(digest_size=16)
+    _update(digest, (name, FIGURE_VERSION, plotly.__version__, list(inputs), params))
+    return digest.hexdigest()
+
+
+# The figure build(*inputs, **params) would return, as the plain dict plotly serializes
+# it to. It is reused from this process or from the cache directory while the inputs
+# and parameters are unchanged, so neither the figure objects nor their validation are
+# rebuilt. A cached figure that cannot be read, e.g. removed by another process, is
+# rebuilt. The dict can be passed to dcc.Graph or to plotly.io.write_image with
+# validate=False
+def cached_figure(name, build, *inputs, cache_dir=CACHE_DIR, **params):
+    key = figure_fingerprint(name, inputs, params)
+    if key in _figures:
+        return _figures[key]
+
+    directory = os.path.join(cache_dir, 'figures', name)
+    path = os.path.join(directory, f'{key}.json')
+    try:
+        with open(path, encoding='utf-8') as f:
+            figure = json.load(f)
+    except (OSError, ValueError):
+        with stage(f'build_figure_{name}'):
+            text = build(*inputs, **params).to_json()
+        os.makedirs(directory, exist_ok=True)
+
+        def write(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(text)
+
+        atomic_write(path, write)
+        # Only the latest figure of each name is kept
+        remove_stale(os.path.join(directory, '*.json'), path)
+        figure = json.loads(text)
+
+    _figures[key] = figure
+    return figure
+
+
+# Build the dashboard figure from the totals and the per-platform aggregates
+def build_dashboard_figure(total_likes, total_messages, total_platforms, age_min, age_max, agg_data):
+    # Create a subplot figure
+    fig = make_subplots(
+        rows=3, cols=4,
+        specs=[
+            [{"type": "indicator"}, {"type": "indicator"}, {"type": "indicator"}, {"type": "indicator"}],  # Row for indicators
+            [{"colspan": 4}, None, None, None],  # Row for the first plot
+            [{"colspan": 4}, None, None, None]   # Row for the second plot
+        ],
+    )
+
+    # Add big numbers (indicators) with titles and labels
+    indicators = [
+        ("Total Likes", total_likes, 1, 1),
+        ("Total Messages", total_messages, 1, 2),
+        ("Total Platforms", total_platforms, 1, 3),
+        (f"Age Range: {age_min} - {age_max}", age_max, 1, 4)
+    ]
+
+    for title, value, row, col in indicators:
+        fig.add_trace(
+            go.Indicator(
+                mode="number",
+                value=value,
+                title={"text": title, "font": {"size": 15}},
+                number={"font": {"size": 20}}
+            ),
+            row=row,
+            col=col
+        )
+
+    # Add line plots for likes and messages by platform
+    for i, color in enumerate(['indianred', 'lightsalmon']):
+        fig.add_trace(
+            go.Scatter(
+                x=agg_data['Platform'],
+                y=agg_data.iloc[:, i + 1],  # Likes or Messages
+                mode='lines+markers',
+                name=agg_data.columns[i + 1],
+                line=dict(color=color, width=2),
+                marker=dict(color=color, size=8),
+            ),
+            row=2,
+            col=1
+        )
+
+    # Add title to the line plot
+    fig.update_layout(
+        height=900,
+        showlegend=True,  # Show legend
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",  # Anchor legend to the bottom
+            y=0.64,  # Position it at the bottom of the page
+            xanchor="center",
+            x=0.5
+        ),
+        title={"text": "<b>Social Media Usage Dashboard</b>", "y": 0.95, "x": 0.5, "xanchor": "center", "yanchor": "top"},
+        margin=dict(t=30, b=20)  # Reduce bottom margin to reduce space
+    )
+
+    # Add y-axis title to the line plot
+    fig.update_yaxes(title_text='Total', row=2, col=1)
+
+    # Add title to the line plot
+    fig.update_layout(
+        annotations=[
+            dict(
+                xref='paper',
+                yref='paper',
+                x=0.5,
+                y=0.7,
+                xanchor='center',
+                yanchor='middle',
+                text='Total of Likes and Messages by Platform',
+                font=dict(size=15),
+                showarrow=False
+            )
+        ]
+    )
+
+    # Add x and y axis titles to the line plot
+    fig.update_xaxes(title_text='Platform', row=2, col=1)
+    fig.update_yaxes(title_text='Total', row=2, col=1)
+    return fig
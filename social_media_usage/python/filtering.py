@@ -0,0 +1,324 @@
+import functools
+import re
+
+import numpy as np
+import pandas as pd
+
+# Compiled filters kept, by query string
+FILTER_CACHE_SIZE = 256
+
+# Relational operators and their word forms. Word forms take an 'i' prefix to compare
+# text case-insensitively, or an 's' prefix for the default case-sensitive comparison
+RELATIONAL = {'=': 'eq', '!=': 'ne', '<': 'lt', '<=': 'le', '>': 'gt', '>=': 'ge'}
+WORD_OPERATORS = {'eq', 'ne', 'lt', 'le', 'gt', 'ge', 'contains', 'datestartswith'}
+UNARY_OPERATORS = {'blank', 'nil', 'num', 'str', 'even', 'odd'}
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<column>\{(?:[^{}\\]|\\.)*\})
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`(?:[^`\\]|\\.)*`)
+      | (?P<symbol>&&|\|\||>=|<=|!=|[=<>!()])
+      | (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![^\s{}()"'`=<>!&|]))
+      | (?P<word>[^\s{}()"'`=<>!&|]+)
+    )''', re.VERBOSE)
+
+
+# A filter query that cannot be parsed, with the position it fails at
+class FilterError(ValueError):
+    pass
+
+
+def _unescape(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def _column_text(column):
+    return '{' + re.sub(r'([\\{}])', r'\\\1', column) + '}'
+
+
+# Split a query into (kind, value, position, text) tokens
+def tokenize(query):
+    tokens, position = [], 0
+    query = query.rstrip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None or match.end() == position:
+            raise FilterError(f'Unexpected {query[position:].strip()[:20]!r} at position {position}')
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind in ('column', 'string'):
+            value = _unescape(text[1:-1])
+        elif kind == 'number':
+            value = float(text)
+        else:
+            value = text
+        tokens.append((kind, value, match.start(kind), text))
+        position = match.end()
+    return tokens
+
+
+# Text of a column's values: category labels or the values themselves, numbers included
+def _text(series):
+    return series.astype('str')
+
+
+# Evaluate a predicate over the text of a column. Categorical columns are evaluated once
+# per category and the result gathered by code; missing values never match
+def _text_mask(series, predicate):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        matches = np.append(np.asarray(predicate(_text(pd.Series(series.cat.categories))), dtype=bool), False)
+        return matches[series.cat.codes.to_numpy()]
+    present = series.notna().to_numpy()
+    result = predicate(_text(series))
+    return np.asarray(pd.Series(result).fillna(False).to_numpy(dtype=bool), dtype=bool) & present
+
+
+# {column} operator value, e.g. {Likes_Received_Per_Day} > 100 or {Platform} icontains insta.
+# A number is kept as a float for numeric columns and as the text it was written as
+# for text columns. That text goes into the canonical form that filtered tables are
+# cached under, so numbers written differently, e.g. 60 and 60.0, which match text
+# columns differently, never share an entry
+class Comparison:
+    def __init__(self, column, operator, value, text=None):
+        self.column = column
+        self.operator = operator
+        self.value = value
+        self.text = value if isinstance(value, str) else (text or repr(value))
+
+    def __str__(self):
+        value = self.text if isinstance(self.value, float) else repr(self.value)
+        return f'{_column_text(self.column)} {self.operator} {value}'
+
+    def compile(self):
+        operator = self.operator
+        case_insensitive = operator.startswith('i') and operator[1:] in WORD_OPERATORS
+        if operator[:1] in ('i', 's') and operator[1:] in WORD_OPERATORS:
+            operator = operator[1:]
+        column, value, text = self.column, self.value, self.text
+        if case_insensitive:
+            text = text.lower()
+
+        def compare(values, other):
+            if operator in ('eq', 'ne'):
+                return values == other
+            return {'lt': values < other, 'le': values <= other,
+                    'gt': values > other, 'ge': values >= other}[operator]
+
+        def text_predicate(values):
+            if case_insensitive:
+                values = values.str.lower()
+            if operator == 'contains':
+                return values.str.contains(text, regex=False)
+            if operator == 'datestartswith':
+                return values.str.startswith(text)
+            return compare(values, text)
+
+        def mask(df):
+            series = df[column]
+            if pd.api.types.is_numeric_dtype(series.dtype) and operator not in ('contains', 'datestartswith'):
+                number = value if isinstance(value, float) else pd.to_numeric(value, errors='coerce')
+                values = series.to_numpy(dtype='float64', na_value=np.nan)
+                matches = compare(values, number) if not np.isnan(number) else np.zeros(len(values), dtype=bool)
+                matches &= ~np.isnan(values)
+            else:
+                matches = _text_mask(series, text_predicate)
+            return ~matches if operator == 'ne' else matches
+
+        return mask
+
+
+# {column} is blank, nil, num, str, even or odd
+class Unary:
+    def __init__(self, column, operator):
+        self.column = column
+        self.operator = operator
+
+    def __str__(self):
+        return f'{_column_text(self.column)} is {self.operator}'
+
+    def compile(self):
+        column, operator = self.column, self.operator
+
+        def mask(df):
+            series = df[column]
+            missing = series.isna().to_numpy()
+            numeric = pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+            if operator == 'nil':
+                return missing
+            if operator == 'blank':
+                return missing | _text_mask(series, lambda values: values.str.strip() == '')
+            if operator == 'num':
+                return ~missing if numeric else np.zeros(len(series), dtype=bool)
+            if operator == 'str':
+                return ~missing if not numeric else np.zeros(len(series), dtype=bool)
+            if not numeric:
+                return np.zeros(len(series), dtype=bool)
+            values = series.to_numpy(dtype='float64', na_value=np.nan)
+            remainder = np.fmod(values, 2)
+            return (remainder == 0) if operator == 'even' else (np.abs(remainder) == 1)
+
+        return mask
+
+
+class Not:
+    def __init__(self, operand):
+        self.operand = operand
+
+    def __str__(self):
+        return f'!({self.operand})'
+
+    def compile(self):
+        operand = self.operand.compile()
+        return lambda df: ~operand(df)
+
+
+# Both operands (&&) or either operand (||)
+class Logical:
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def __str__(self):
+        return f'({self.left}) {self.operator} ({self.right})'
+
+    def compile(self):
+        left, right = self.left.compile(), self.right.compile()
+        if self.operator == '&&':
+            return lambda df: left(df) & right(df)
+        return lambda df: left(df) | right(df)
+
+
+# Recursive descent parser over the tokens of a query:
+#
+#     or         := and (('||' | 'or') and)*
+#     and        := unary (('&&' | 'and') unary)*
+#     unary      := ('!' | 'not') unary | '(' or ')' | comparison
+#     comparison := {column} operator value | {column} 'is' unary-operator
+class _Parser:
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None, len(self.query), '')
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def fail(self, expected):
+        kind, value, position, _ = self.peek()
+        found = 'end of query' if kind is None else repr(value)
+        raise FilterError(f'Expected {expected} at position {position}, found {found}')
+
+    def accept(self, *values):
+        kind, value, _, _ = self.peek()
+        if kind in ('symbol', 'word') and isinstance(value, str) and value.lower() in values:
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        if not self.tokens:
+            return None
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            self.fail("'&&', '||' or end of query")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.accept('||', 'or'):
+            node = Logical('||', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_unary()
+        while self.accept('&&', 'and'):
+            node = Logical('&&', node, self.parse_unary())
+        return node
+
+    def parse_unary(self):
+        if self.accept('!', 'not'):
+            return Not(self.parse_unary())
+        if self.accept('('):
+            node = self.parse_or()
+            if not self.accept(')'):
+                self.fail("')'")
+            return node
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        kind, column, _, _ = self.peek()
+        if kind != 'column':
+            self.fail('a {column}')
+        self.take()
+
+        kind, operator, _, _ = self.peek()
+        if kind == 'word' and operator.lower() == 'is':
+            self.take()
+            kind, operator, _, _ = self.peek()
+            if kind != 'word' or operator.lower() not in UNARY_OPERATORS:
+                self.fail(f'one of {", ".join(sorted(UNARY_OPERATORS))}')
+            self.take()
+            return Unary(column, operator.lower())
+
+        if kind == 'symbol' and operator in RELATIONAL:
+            operator = RELATIONAL[operator]
+        elif kind == 'word' and (operator.lower() in WORD_OPERATORS
+                                 or operator[:1].lower() in ('i', 's') and operator[1:].lower() in WORD_OPERATORS):
+            operator = operator.lower()
+        else:
+            self.fail('an operator')
+        self.take()
+
+        kind, value, _, text = self.peek()
+        if kind not in ('string', 'number', 'word'):
+            self.fail('a value')
+        self.take()
+        return Comparison(column, operator, value, text if kind == 'number' else None)
+
+
+# Expression tree of a filter query in the syntax of Dash DataTable filter_query, e.g.
+# '{Platform} = Instagram && {Likes_Received_Per_Day} > 100'; None for an empty query
+def parse_filter(query):
+    return _Parser(query).parse()
+
+
+# A parsed query compiled into a function from a frame to a boolean mask over its rows.
+# Each operator is a vectorized comparison over whole columns; text operators on
+# categorical columns only look at the categories
+class Filter:
+    def __init__(self, query):
+        self.query = query
+        self.tree = parse_filter(query)
+        self.key = str(self.tree) if self.tree is not None else ''
+        self.columns = set(_columns(self.tree))
+        self._mask = self.tree.compile() if self.tree is not None else None
+
+    def __call__(self, df):
+        missing = self.columns - set(df.columns)
+        if missing:
+            raise FilterError(f'Unknown columns {", ".join(sorted(missing))}')
+        if self._mask is None:
+            return np.ones(len(df), dtype=bool)
+        return np.asarray(self._mask(df), dtype=bool)
+
+
+def _columns(node):
+    if node is None:
+        return []
+    if isinstance(node, (Comparison, Unary)):
+        return [node.column]
+    if isinstance(node, Not):
+        return _columns(node.operand)
+    return _columns(node.left) + _columns(node.right)
+
+
+# The compiled filter of a query, parsed and compiled once per query string
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def compile_filter(query):
+    return Filter(query)
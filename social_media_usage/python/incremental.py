@@ -0,0 +1,163 @@
+import copy
+import hashlib
+import io
+import os
+import pickle
+
+from cache import CACHE_DIR, atomic_write
+from cube import DISTRIBUTION_COLUMNS, Cube
+from dedup import DEFAULT_KEYS, DedupStore
+from instrumentation import stage
+from loader import read_social_media
+from sketches import DEFAULT_ERROR, GroupedDistinct, GroupedQuantiles
+
+# Bytes just before the processed offset that must be unchanged for the file to count
+# as appended to rather than rewritten
+FINGERPRINT_SIZE = 64 * 1024
+
+# Bump whenever the layout of AggregateState changes, so older pickles are rebuilt
+STATE_FORMAT = 4
+
+
+# Aggregates of every row applied so far, with enough bookkeeping to apply only the
+# rows appended to the export since the last refresh: the byte offset read up to,
+# the header and a fingerprint of the bytes before the offset, and, when duplicates
+# are dropped, the keys of every row already counted. deduplicate is False to count
+# every row, True to drop rows with a repeated User_ID, or a list of key columns,
+# None meaning whole rows. Distinct users per platform and per emotion are counted
+# with HyperLogLog sketches within distinct_error, or exactly when it is None, and
+# the distributions of DISTRIBUTION_COLUMNS per platform with t-digests
+class AggregateState:
+    def __init__(self, version, dimensions, deduplicate, distinct_error=DEFAULT_ERROR):
+        self.format = STATE_FORMAT
+        self.version = version
+        self.dimensions = list(dimensions)
+        self.deduplicate = deduplicate
+        self.distinct_error = distinct_error
+        self.users_by_platform = GroupedDistinct('Platform', 'User_ID', distinct_error)
+        self.users_by_emotion = GroupedDistinct('Dominant_Emotion', 'User_ID', distinct_error)
+        self.distributions = GroupedQuantiles('Platform', DISTRIBUTION_COLUMNS)
+        self.offset = 0
+        self.header = None
+        self.fingerprint = None
+        self.cube = None
+        self.rows_applied = 0
+        self.dedup = None
+        if deduplicate is not False:
+            self.dedup = DedupStore(DEFAULT_KEYS if deduplicate is True else deduplicate)
+        # Rows dropped as duplicates by the latest refresh
+        self.dedup_report = None
+
+    # Whether this state was built with the same cleaning version and options
+    def compatible(self, version, dimensions, deduplicate, distinct_error=DEFAULT_ERROR):
+        return (getattr(self, 'format', None) == STATE_FORMAT and self.version == version
+                and self.dimensions == list(dimensions) and self.deduplicate == deduplicate
+                and self.distinct_error == distinct_error)
+
+    def _report(self, report):
+        if self.dedup_report is None:
+            return report
+        return self.dedup_report.combine(report)
+
+    # Fold cleaned delta rows into the aggregates. Returns the number of rows applied
+    def apply_delta(self, df):
+        if self.dedup is not None:
+            with stage('deduplicate', rows_in=len(df)) as rows:
+                df, report = self.dedup.add(df)
+                self.dedup_report = self._report(report)
+                rows.rows_out = len(df)
+
+        delta = Cube.build(df, self.dimensions)
+        self.cube = delta if self.cube is None else self.cube.merge(delta)
+        self.users_by_platform.update(df)
+        self.users_by_emotion.update(df)
+        self.distributions.update(df)
+        self.rows_applied += len(df)
+        return len(df)
+
+    # Copy of the state with extra cleaned rows folded into its cube, leaving this state
+    # and its seen keys untouched
+    def including(self, df):
+        state = copy.copy(self)
+        if self.dedup is not None:
+            df, report = self.dedup.peek(df)
+            state.dedup_report = self._report(report)
+        state.cube = self.cube.merge(Cube.build(df, self.dimensions))
+        state.users_by_platform = self.users_by_platform.merge(
+            GroupedDistinct('Platform', 'User_ID', self.distinct_error).update(df))
+        state.users_by_emotion = self.users_by_emotion.merge(
+            GroupedDistinct('Dominant_Emotion', 'User_ID', self.distinct_error).update(df))
+        state.distributions = self.distributions.merge(GroupedQuantiles('Platform', DISTRIBUTION_COLUMNS).update(df))
+        state.rows_applied = self.rows_applied + len(df)
+        return state
+
+
+def _fingerprint(f, offset):
+    start = max(offset - FINGERPRINT_SIZE, 0)
+    f.seek(start)
+    return hashlib.blake2b(f.read(offset - start), digest_size=16).hexdigest()
+
+
+def state_path(name, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f'{name}-state.pkl')
+
+
+def load_state(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+
+def save_state(state, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    atomic_write(path, write)
+
+
+# Bring the persisted aggregates up to date with the CSV and return them. Only the
+# lines appended since the last refresh are parsed and cleaned with prepare(df); if
+# the file was rewritten rather than appended to, or the cleaning version or options
+# changed, the state is rebuilt from the whole file
+def refresh_state(csv_path, prepare, name, version, dimensions, deduplicate, distinct_error=DEFAULT_ERROR,
+                  cache_dir=CACHE_DIR):
+    path = state_path(name, cache_dir)
+    state = load_state(path)
+    if state is None or not state.compatible(version, dimensions, deduplicate, distinct_error):
+        state = AggregateState(version, dimensions, deduplicate, distinct_error)
+    state.dedup_report = None
+
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        size = os.fstat(f.fileno()).st_size
+        appended = (state.header == header and state.offset <= size
+                    and state.fingerprint == _fingerprint(f, state.offset))
+        if not appended:
+            state = AggregateState(version, dimensions, deduplicate, distinct_error)
+
+        start = max(state.offset, len(header))
+        f.seek(start)
+        data = f.read()
+
+        # Only complete lines are persisted. An unterminated last line may still be
+        # being written, so it is counted for this run but read again next time
+        end = data.rfind(b'\n') + 1
+        complete, tail = data[:end], data[end:]
+        if complete or state.cube is None:
+            if complete.strip() or state.cube is None:
+                delta = read_social_media(io.BytesIO(header + complete))
+                state.apply_delta(prepare(delta))
+
+            state.header = header
+            state.offset = start + len(complete)
+            state.fingerprint = _fingerprint(f, state.offset)
+            save_state(state, path)
+
+    if tail.strip():
+        return state.including(prepare(read_social_media(io.BytesIO(header + tail))))
+    return state
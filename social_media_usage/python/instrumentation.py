@@ -0,0 +1,187 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from cache import atomic_write
+
+# Report of the run in progress; stages are only recorded while one is active
+_active = None
+
+
+# Measurements of one pipeline stage. Repeated stages, e.g. one per chunk, are merged
+# into a single record: times and rows add up, peak memory is the highest seen
+class StageRecord:
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_memory_bytes = None
+        self.rows_in = None
+        self.rows_out = None
+
+    def to_dict(self):
+        return {
+            'stage': self.path,
+            'calls': self.calls,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'peak_memory_bytes': self.peak_memory_bytes,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+        }
+
+
+# Row counts of the current call of a stage, set by the code being measured
+class StageRows:
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+
+
+def _add(total, value):
+    if value is None:
+        return total
+    return value if total is None else total + value
+
+
+# Stage timings, CPU time, traced memory peaks and row counts of one run
+class RunReport:
+    def __init__(self, name, trace_memory=True):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started_at = datetime.now(timezone.utc)
+        self.records = {}
+        self.wall_seconds = None
+        self._stack = []
+        self._start = time.perf_counter()
+        self._started_tracing = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return self
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self._start
+        if self._started_tracing:
+            tracemalloc.stop()
+        return self
+
+    # Measure the enclosed block as a stage, nested under any stage already open.
+    # Peak memory is the highest traced allocation above what was in use on entry
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        path = '/'.join([frame['path'] for frame in self._stack[-1:]] + [name])
+        record = self.records.setdefault(path, StageRecord(path))
+        rows = StageRows(rows_in)
+
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        frame = {'path': path, 'start_memory': current, 'peak': current}
+        self._stack.append(frame)
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield rows
+        finally:
+            record.calls += 1
+            record.wall_seconds += time.perf_counter() - wall
+            record.cpu_seconds += time.process_time() - cpu
+            record.rows_in = _add(record.rows_in, rows.rows_in)
+            record.rows_out = _add(record.rows_out, rows.rows_out)
+
+            self._stack.pop()
+            if tracing:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                used = peak - frame['start_memory']
+                record.peak_memory_bytes = max(record.peak_memory_bytes or 0, used)
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+
+    def to_dict(self):
+        return {
+            'run': self.name,
+            'started_at': self.started_at.isoformat(),
+            'wall_seconds': round(self.wall_seconds if self.wall_seconds is not None
+                                  else time.perf_counter() - self._start, 6),
+            'stages': [record.to_dict() for record in self.records.values()],
+        }
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    # Prometheus text exposition format, e.g. for the node exporter textfile collector
+    def write_prometheus(self, path, prefix='dashboard'):
+        metrics = [
+            ('stage_wall_seconds', 'Wall time spent in the pipeline stage', 'wall_seconds'),
+            ('stage_cpu_seconds', 'CPU time spent in the pipeline stage', 'cpu_seconds'),
+            ('stage_peak_memory_bytes', 'Peak traced memory above the stage start', 'peak_memory_bytes'),
+            ('stage_rows_in', 'Rows entering the pipeline stage', 'rows_in'),
+            ('stage_rows_out', 'Rows leaving the pipeline stage', 'rows_out'),
+        ]
+        lines = []
+        for metric, help_text, attribute in metrics:
+            lines.append(f'# HELP {prefix}_{metric} {help_text}')
+            lines.append(f'# TYPE {prefix}_{metric} gauge')
+            for record in self.records.values():
+                value = getattr(record, attribute)
+                if value is not None:
+                    labels = f'run="{_escape(self.name)}",stage="{_escape(record.path)}"'
+                    lines.append(f'{prefix}_{metric}{{{labels}}} {value}')
+        lines.append(f'# HELP {prefix}_run_wall_seconds Wall time of the whole run')
+        lines.append(f'# TYPE {prefix}_run_wall_seconds gauge')
+        lines.append(f'{prefix}_run_wall_seconds{{run="{_escape(self.name)}"}} {self.to_dict()["wall_seconds"]}')
+
+        # Written through a temporary file so the collector never reads a partial file
+        def write(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+
+        atomic_write(path, write)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Start recording a run; stages opened anywhere in the pipeline are added to it
+def start_run(name, trace_memory=True):
+    global _active
+    _active = RunReport(name, trace_memory).start()
+    return _active
+
+
+# Stop recording and return the report, writing it when paths are given
+def finish_run(json_path=None, prometheus_path=None):
+    global _active
+    report, _active = _active, None
+    if report is None:
+        return None
+    report.stop()
+    if json_path:
+        report.write_json(json_path)
+    if prometheus_path:
+        report.write_prometheus(prometheus_path)
+    return report
+
+
+# Measure a stage of the active run. Without an active run this only hands out a
+# StageRows object, so instrumented code costs nothing when nobody is recording
+@contextmanager
+def stage(name, rows_in=None):
+    if _active is None:
+        yield StageRows(rows_in)
+        return
+    with _active.stage(name, rows_in) as rows:
+        yield rows
@@ -0,0 +1,97 @@
+import pandas as pd
+
+from instrumentation import stage
+from schema import SOCIAL_MEDIA_SCHEMA
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+# Strings pd.read_csv treats as missing by default, so both backends agree on nulls
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+
+# Single-threaded pandas C parser, the reference backend. Blank lines are skipped
+def _read_pandas(path, dtypes, **kwargs):
+    return pd.read_csv(path, encoding='utf-8', dtype=dtypes, **kwargs)
+
+
+# Multi-threaded Arrow CSV reader. Blank lines are skipped, and typed columns are
+# converted to the same pandas dtypes the pandas backend produces. Files Arrow
+# cannot convert are read with pandas instead, from the same start for file objects
+def _read_pyarrow(path, dtypes):
+    start = path.tell() if hasattr(path, 'seek') else None
+    column_types = {}
+    types_mapper = {}
+    for column, dtype in dtypes.items():
+        if dtype == 'category':
+            column_types[column] = pa.dictionary(pa.int32(), pa.string())
+        else:
+            arrow_type = pa.from_numpy_dtype(dtype.numpy_dtype)
+            column_types[column] = arrow_type
+            types_mapper[arrow_type] = dtype
+
+    try:
+        table = pa_csv.read_csv(
+            path,
+            read_options=pa_csv.ReadOptions(use_threads=True, encoding='utf-8'),
+            parse_options=pa_csv.ParseOptions(ignore_empty_lines=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=column_types,
+                null_values=NA_VALUES,
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=True,
+            ),
+        )
+    except pa.ArrowInvalid:
+        # Values Arrow will not convert but pandas accepts, e.g. '1.0' in an integer column
+        # or a short last row still being written. Arrow has read a file object to its end
+        if start is not None:
+            path.seek(start)
+        return _read_pandas(path, dtypes)
+    df = table.to_pandas(types_mapper=types_mapper.get)
+
+    # Arrow keeps categories in order of appearance, pandas sorts them
+    for column, dtype in dtypes.items():
+        if dtype == 'category' and column in df.columns:
+            df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+    return df
+
+
+# Parser backends by name
+BACKENDS = {
+    'pandas': _read_pandas,
+    'pyarrow': _read_pyarrow,
+}
+
+
+# Pick the pyarrow backend when it is installed and the call only needs a plain full read
+def _default_backend(kwargs):
+    if pa is not None and not kwargs:
+        return 'pyarrow'
+    return 'pandas'
+
+
+# Read the social media CSV with the declared dtypes, so text columns load straight
+# into categoricals and counters into narrow integers. backend is 'pandas', 'pyarrow'
+# or None to use pyarrow when available; extra keyword arguments such as chunksize
+# are passed to pandas, which is then always used
+def read_social_media(path, schema=SOCIAL_MEDIA_SCHEMA, backend=None, **kwargs):
+    backend = backend or _default_backend(kwargs)
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown CSV backend {backend!r}, expected one of {", ".join(BACKENDS)}')
+    if backend == 'pyarrow':
+        if pa is None:
+            raise ImportError('The pyarrow backend needs pyarrow to be installed')
+        if kwargs:
+            raise TypeError(f'The pyarrow backend does not accept {", ".join(kwargs)}')
+    if 'chunksize' in kwargs or kwargs.get('iterator'):
+        return BACKENDS[backend](path, schema.read_dtypes(), **kwargs)
+
+    with stage('read_csv') as rows:
+        df = BACKENDS[backend](path, schema.read_dtypes(), **kwargs)
+        rows.rows_out = len(df)
+    return df
@@ -1,152 +1,247 @@
-import pandas as pd
+import argparse
 import os
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import sys
+
+from aggregation import aggregate_metrics
+from cache import load_cached
+from cleaning import CLEANING_VERSION, clean_social_media
+from cube import AGE_MAX, AGE_MIN
+from incremental import refresh_state
+from instrumentation import finish_run, stage, start_run
+from loader import read_social_media
+from metrics import DashboardMetrics
+from parallel import set_workers
+from sketches import DEFAULT_ERROR
+from streaming import stream_totals
+from validation import ValidationReport, format_validation_report
+
+# Plotting and rendering modules (figures, export, reports) pull in plotly and the
+# renderer, so they are only imported by the commands that render. The aggregate
+# command then starts in about the time pandas takes to import
 
-# Function to correct swapped Age and Gender values
-def correct_age_gender(df, age_col='Age', gender_col='Gender'):
-    def correct_row(row):
-        age, gender = row[age_col], row[gender_col]
+# Define the absolute path to the CSV file
+csv_input_path = os.path.join(os.path.dirname(__file__), '../test.csv')
 
-        # Convert strings to numeric values if possible
-        try:
-            age = int(age)
-        except (ValueError, TypeError):
-            pass
+# Default output paths of the dashboard and of the aggregated metrics
+pdf_output_path = os.path.join(os.path.dirname(__file__), 'dashboard.pdf')
+metrics_output_path = os.path.join(os.path.dirname(__file__), 'metrics.json')
 
-        if isinstance(age, int) and (0 <= age <= 120):
-            # Age is valid
-            return age, gender
+COMMANDS = ['aggregate', 'render', 'all']
 
-        # Otherwise, check if gender is actually the age
-        try:
-            potential_age = int(gender)
-            if 0 <= potential_age <= 120:
-                # Swap age and gender if the potential age is valid
-                return potential_age, age
-        except (ValueError, TypeError):
-            pass
+# Violation counts and quarantined rows of every row cleaned in this run
+validation = ValidationReport()
 
-        # Default return original values
-        return row[age_col], row[gender_col]
 
-    df[age_col], df[gender_col] = zip(*df.apply(correct_row, axis=1))
-    return df
+# Create and clean the DataFrame from the CSV file
+def build_dataframe(path):
+    df = read_social_media(path)
+    return clean_social_media(df, validation)
 
-# Define the absolute path to the CSV file
-csv_input_path = os.path.join(os.path.dirname(__file__), '../test.csv')
 
-# Create DataFrame
-df = pd.read_csv(csv_input_path, encoding='utf-8')
-
-# Correct Age and Gender columns
-df = correct_age_gender(df)
-
-# Ensure Age column contains only numeric values and convert to int
-df['Age'] = pd.to_numeric(df['Age'], errors='coerce').fillna(0).astype(int)
-
-# Handle incorrect gender entries, assume valid genders are 'Male', 'Female', 'Other'
-valid_genders = ['Male', 'Female', 'Other']
-df['Gender'] = df['Gender'].apply(lambda x: x if x in valid_genders else 'Other')
-
-# Calculate total metrics
-total_likes = df['Likes_Received_Per_Day'].sum()
-total_messages = df['Messages_Sent_Per_Day'].sum()
-total_platforms = df['Platform'].nunique()
-
-# Calculate likes and messages by platform
-likes_by_platform = df.groupby('Platform')['Likes_Received_Per_Day'].sum().reset_index()
-messages_by_platform = df.groupby('Platform')['Messages_Sent_Per_Day'].sum().reset_index()
-
-# Combine data for likes and messages
-agg_data = pd.merge(likes_by_platform, messages_by_platform, on='Platform')
-
-# Create a subplot figure
-fig = make_subplots(
-    rows=3, cols=4,
-    specs=[
-        [{"type": "indicator"}, {"type": "indicator"}, {"type": "indicator"}, {"type": "indicator"}],  # Row for indicators
-        [{"colspan": 4}, None, None, None],  # Row for the first plot
-        [{"colspan": 4}, None, None, None]   # Row for the second plot
-    ],
-)
-
-# Add big numbers (indicators) with titles and labels
-indicators = [
-    ("Total Likes", total_likes, 1, 1),
-    ("Total Messages", total_messages, 1, 2),
-    ("Total Platforms", total_platforms, 1, 3),
-    (f"Age Range: {df['Age'].min()} - {df['Age'].max()}", df['Age'].max(), 1, 4)
-]
-
-for title, value, row, col in indicators:
-    fig.add_trace(
-        go.Indicator(
-            mode="number",
-            value=value,
-            title={"text": title, "font": {"size": 15}},
-            number={"font": {"size": 20}}
-        ),
-        row=row,
-        col=col
-    )
-
-# Add line plots for likes and messages by platform
-for i, color in enumerate(['indianred', 'lightsalmon']):
-    fig.add_trace(
-        go.Scatter(
-            x=agg_data['Platform'],
-            y=agg_data.iloc[:, i + 1],  # Likes or Messages
-            mode='lines+markers',
-            name=agg_data.columns[i + 1],
-            line=dict(color=color, width=2),
-            marker=dict(color=color, size=8),
-        ),
-        row=2,
-        col=1
-    )
-
-# Add title to the line plot
-fig.update_layout(
-    height=900,
-    showlegend=True,  # Show legend
-    legend=dict(
-        orientation="h",
-        yanchor="bottom",  # Anchor legend to the bottom
-        y=0.64,  # Position it at the bottom of the page
-        xanchor="center",
-        x=0.5
-    ),
-    title={"text": "<b>Social Media Usage Dashboard</b>", "y": 0.95, "x": 0.5, "xanchor": "center", "yanchor": "top"},
-    margin=dict(t=30, b=20)  # Reduce bottom margin to reduce space
-)
-
-# Add y-axis title to the line plot
-fig.update_yaxes(title_text='Total', row=2, col=1)
-
-# Add title to the line plot
-fig.update_layout(
-    annotations=[
-        dict(
-            xref='paper',
-            yref='paper',
-            x=0.5,
-            y=0.7,
-            xanchor='center',
-            yanchor='middle',
-            text='Total of Likes and Messages by Platform',
-            font=dict(size=15),
-            showarrow=False
-        )
-    ]
-)
+# Load the cleaned DataFrame, reusing the cached copy while the CSV is unchanged. The
+# cached copy was validated by an earlier run, so use_cache=False cleans the CSV again
+# when this run's validation results are needed
+def load_frame(use_cache=True):
+    with stage('load') as rows:
+        if use_cache:
+            df = load_cached(csv_input_path, build_dataframe, name='main', version=CLEANING_VERSION)
+        else:
+            df = build_dataframe(csv_input_path)
+        rows.rows_out = len(df)
+    return df
 
-# Add x and y axis titles to the line plot
-fig.update_xaxes(title_text='Platform', row=2, col=1)
-fig.update_yaxes(title_text='Total', row=2, col=1)
 
-# Save as PDF
-pdf_output_path = os.path.join(os.path.dirname(__file__), 'dashboard.pdf')
-fig.write_image(pdf_output_path, engine="kaleido")
+# Aggregate the CSV into the dashboard metrics, in the mode the arguments select. Returns
+# the metrics and the cleaned frame, which only the in-memory mode loads
+def compute_metrics(args):
+    if args.incremental:
+        # Update the persisted per-platform aggregates with the appended rows only
+        with stage('refresh_state'):
+            state = refresh_state(csv_input_path, lambda df: clean_social_media(df, validation), name='main',
+                                  version=CLEANING_VERSION, dimensions=['Platform'], deduplicate=False,
+                                  distinct_error=args.distinct_error)
+        totals = state.cube.totals()
+        metrics = DashboardMetrics(
+            totals['Likes_Received_Per_Day'], totals['Messages_Sent_Per_Day'], state.cube.distinct('Platform'),
+            totals[AGE_MIN], totals[AGE_MAX],
+            state.cube.rollup(['Platform'], ['Likes_Received_Per_Day', 'Messages_Sent_Per_Day']),
+            state.users_by_platform.counts())
+        return metrics, None
+
+    if args.chunksize:
+        # Stream the CSV, keeping only running totals in memory
+        with stage('stream_totals'):
+            totals = stream_totals(csv_input_path, args.chunksize, validation, args.distinct_error)
+        metrics = DashboardMetrics(
+            totals.total_likes, totals.total_messages, totals.total_platforms, totals.age_min, totals.age_max,
+            totals.agg_data(), totals.users_by_platform.counts())
+        return metrics, None
+
+    # The quarantine is only known when the rows are cleaned
+    df = load_frame(use_cache=not args.quarantine)
+
+    # Calculate total metrics
+    with stage('totals', rows_in=len(df)):
+        total_likes = df['Likes_Received_Per_Day'].sum()
+        total_messages = df['Messages_Sent_Per_Day'].sum()
+        total_platforms = df['Platform'].nunique()
+        age_min, age_max = df['Age'].min(), df['Age'].max()
+
+    # Calculate likes and messages by platform in a single pass
+    agg_data = aggregate_metrics(df, [('Likes_Received_Per_Day', 'sum'), ('Messages_Sent_Per_Day', 'sum')])
+    users_by_platform = df.groupby('Platform', observed=True)['User_ID'].nunique()
+    return DashboardMetrics(total_likes, total_messages, total_platforms, age_min, age_max, agg_data,
+                            users_by_platform), df
+
+
+# Render the dashboard as PDF, along with any other requested formats and sizes
+def render(metrics, exports):
+    from export import ExportJob, export_batch, export_path, format_export_report
+    from figures import build_dashboard_figure, cached_figure
+
+    # Create the dashboard figure, reusing the cached one while its inputs are unchanged
+    with stage('build_figure'):
+        fig = cached_figure('dashboard', build_dashboard_figure, *metrics.figure_inputs())
+
+    jobs = [ExportJob(fig, pdf_output_path)] + [
+        ExportJob(fig, export_path(pdf_output_path, format, width, height), format, width, height)
+        for format, width, height in exports
+    ]
+    with stage('write_image'):
+        results = export_batch(jobs)
+
+    print(f'Dashboard saved as {pdf_output_path}')
+    if exports:
+        print(format_export_report(results))
+
+
+# Fan the dashboard out to every segment, from the cleaned rows whatever the mode
+def write_segment_reports(df, directory, workers):
+    from reports import format_manifest, plan_segment_reports, render_segment_reports
+
+    if df is None:
+        df = load_frame()
+    with stage('segment_aggregates', rows_in=len(df)):
+        reports = plan_segment_reports(df, directory)
+    manifest = render_segment_reports(reports, directory, workers)
+    print(f'Segment reports saved in {directory}: {format_manifest(manifest)}')
+
+
+def print_distinct_users(metrics):
+    print('Distinct users per platform: ' + ', '.join(
+        f'{platform} {users}' for platform, users in metrics.users_by_platform.items()))
+
+
+# Print the validation report and write the quarantine of the rows cleaned in this run
+def finish_validation(args):
+    # Rows are only validated when they are cleaned, not when a cached frame is reused
+    if validation.counts is not None:
+        print(format_validation_report(validation))
+    if args.quarantine:
+        if validation.counts is None:
+            # In incremental mode only appended rows are cleaned
+            print(f'Quarantine not written to {args.quarantine}: no rows were validated in this run')
+        else:
+            validation.write_quarantine(args.quarantine)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Build the social media usage PDF dashboard. Without a command, runs all')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    run = argparse.ArgumentParser(add_help=False)
+    run.add_argument('--report', default=None,
+                     help='Write stage timings, CPU time, peak memory and row counts to this JSON file')
+    run.add_argument('--prometheus', default=None,
+                     help='Also write the stage measurements in Prometheus text format to this file')
+
+    compute = argparse.ArgumentParser(add_help=False)
+    compute.add_argument('--chunksize', type=int, default=None,
+                         help='Stream the CSV in chunks of this many rows instead of loading it whole')
+    compute.add_argument('--incremental', action='store_true',
+                         help='Only process rows appended since the last run, updating persisted aggregates')
+    compute.add_argument('--workers', type=int, default=1,
+                         help='Split large aggregations over this many worker processes')
+    compute.add_argument('--distinct-error', type=float, default=DEFAULT_ERROR,
+                         help='Relative error of the HyperLogLog sketches distinct users are counted with '
+                              'in chunked and incremental modes')
+    compute.add_argument('--exact-distinct', action='store_const', const=None, dest='distinct_error',
+                         help='Count distinct users exactly in chunked and incremental modes, keeping every '
+                              'User_ID seen; slower and larger than the sketches on big exports')
+    compute.add_argument('--quarantine', default=None,
+                         help='Write the rows rejected by validation to this CSV file')
+
+    # Export specs are parsed once rendering starts, so parsing the arguments needs no plotly
+    rendering = argparse.ArgumentParser(add_help=False)
+    rendering.add_argument('--export', action='append', default=[], metavar='FORMAT[:WxH]',
+                           help='Also export the dashboard in this format and size, e.g. png:1600x1200 or svg; '
+                                'may be repeated. Every file is rendered in one renderer session')
+
+    aggregate = commands.add_parser('aggregate', parents=[run, compute],
+                                    help='Aggregate the CSV into the dashboard metrics, without rendering')
+    aggregate.add_argument('--output', default=metrics_output_path,
+                           help='Write the metrics to this file, as Parquet for a .parquet path, '
+                                'otherwise as JSON')
+
+    render_parser = commands.add_parser('render', parents=[run, rendering],
+                                        help='Render the dashboard from metrics written by aggregate')
+    render_parser.add_argument('--metrics', default=metrics_output_path,
+                               help='Metrics file written by aggregate, JSON or Parquet')
+
+    all_parser = commands.add_parser('all', parents=[run, compute, rendering],
+                                     help='Aggregate the CSV and render the dashboard')
+    all_parser.add_argument('--segment-reports', default=None, metavar='DIR',
+                            help='Also write a dashboard for every Platform, Age Range and Dominant_Emotion '
+                                 'segment to this directory, rendered across --workers processes, '
+                                 'with a manifest of how long each took')
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Running without a command, with or without options, builds everything as before
+    if not argv or argv[0] not in COMMANDS + ['-h', '--help']:
+        argv = ['all'] + argv
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    exports = []
+    if args.command != 'aggregate':
+        from export import parse_export_spec
 
-print(f'Dashboard saved as {pdf_output_path}')
+        try:
+            exports = [parse_export_spec(spec) for spec in args.export]
+        except ValueError as error:
+            parser.error(str(error))
+    if args.command != 'render':
+        set_workers(args.workers)
+
+    if args.report or args.prometheus:
+        start_run('main' if args.command == 'all' else f'main-{args.command}')
+
+    if args.command == 'render':
+        metrics = DashboardMetrics.read(args.metrics)
+        render(metrics, exports)
+        print_distinct_users(metrics)
+    elif args.command == 'aggregate':
+        metrics, _ = compute_metrics(args)
+        with stage('write_metrics'):
+            metrics.write(args.output)
+        print(f'Metrics saved as {args.output}')
+        print_distinct_users(metrics)
+        finish_validation(args)
+    else:
+        metrics, df = compute_metrics(args)
+        render(metrics, exports)
+        print_distinct_users(metrics)
+        finish_validation(args)
+        if args.segment_reports:
+            write_segment_reports(df, args.segment_reports, args.workers)
+
+    # Write the run report when one was requested
+    finish_run(args.report, args.prometheus)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import atomic_write
+
+LIKES = 'Likes_Received_Per_Day'
+MESSAGES = 'Messages_Sent_Per_Day'
+DISTINCT_USERS = 'Distinct_Users'
+
+# Totals written alongside the per-platform rows
+TOTALS = ['total_likes', 'total_messages', 'total_platforms', 'age_min', 'age_max']
+
+
+# Numpy scalars as the Python numbers JSON can hold, missing values as None
+def _plain(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# Everything the dashboard is drawn from: the totals shown as indicators, likes and
+# messages per platform and distinct users per platform. It is what the aggregate
+# step writes and the render step reads, as JSON or, for a .parquet path, as a
+# Parquet table of the platforms with the totals in its metadata
+class DashboardMetrics:
+    def __init__(self, total_likes, total_messages, total_platforms, age_min, age_max, agg_data,
+                 users_by_platform):
+        self.total_likes = total_likes
+        self.total_messages = total_messages
+        self.total_platforms = total_platforms
+        self.age_min = age_min
+        self.age_max = age_max
+        self.agg_data = agg_data
+        self.users_by_platform = users_by_platform
+
+    # Positional inputs of figures.build_dashboard_figure
+    def figure_inputs(self):
+        return (self.total_likes, self.total_messages, self.total_platforms, self.age_min, self.age_max,
+                self.agg_data)
+
+    def totals(self):
+        return {name: _plain(getattr(self, name)) for name in TOTALS}
+
+    # One row per platform with its likes, messages and distinct users
+    def platforms(self):
+        platforms = pd.DataFrame({
+            'Platform': self.agg_data['Platform'].astype(str).to_numpy(),
+            LIKES: self.agg_data[LIKES].to_numpy(),
+            MESSAGES: self.agg_data[MESSAGES].to_numpy(),
+        })
+        users = self.users_by_platform.rename(index=str)
+        platforms[DISTINCT_USERS] = platforms['Platform'].map(users).fillna(0).astype('int64')
+        return platforms
+
+    @classmethod
+    def _from_platforms(cls, totals, platforms):
+        agg_data = platforms[['Platform', LIKES, MESSAGES]].reset_index(drop=True)
+        users = pd.Series(platforms[DISTINCT_USERS].to_numpy(), index=pd.Index(platforms['Platform'], name='Platform'),
+                          name='User_ID')
+        return cls(**{name: totals.get(name) for name in TOTALS}, agg_data=agg_data, users_by_platform=users)
+
+    def to_dict(self):
+        return dict(self.totals(), platforms=[
+            {column: _plain(value) for column, value in row.items()}
+            for row in self.platforms().to_dict('records')
+        ])
+
+    @classmethod
+    def from_dict(cls, data):
+        platforms = pd.DataFrame(data['platforms'], columns=['Platform', LIKES, MESSAGES, DISTINCT_USERS])
+        return cls._from_platforms(data, platforms)
+
+    def write(self, path):
+        if os.path.splitext(path)[1].lower() == '.parquet':
+            platforms = self.platforms()
+            platforms.attrs['totals'] = self.totals()
+
+            def write(tmp):
+                platforms.to_parquet(tmp, index=False)
+        else:
+            def write(tmp):
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(self.to_dict(), f, indent=2)
+
+        atomic_write(path, write)
+
+    @classmethod
+    def read(cls, path):
+        if os.path.splitext(path)[1].lower() == '.parquet':
+            platforms = pd.read_parquet(path)
+            return cls._from_platforms(platforms.attrs.get('totals', {}), platforms)
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
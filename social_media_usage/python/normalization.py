@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+
+# Fold case and whitespace so ' non-Binary ' and 'Non-binary' compare equal
+def fold(value):
+    return ' '.join(str(value).split()).casefold()
+
+
+# Map the values of a text column onto a whitelist of canonical values. Matching
+# ignores case and surrounding or repeated whitespace, aliases map extra spellings
+# onto a canonical value, and anything else goes to the default bucket, or is kept
+# with its whitespace folded when there is no default. The mapping is worked out
+# once per distinct value and applied to the category codes with a single take, so
+# its cost depends on the number of distinct values rather than the number of rows
+class CategoryNormalizer:
+    def __init__(self, valid, aliases=None, default=None):
+        self.lookup = {fold(value): value for value in valid}
+        for alias, value in (aliases or {}).items():
+            self.lookup[fold(alias)] = value
+        self.default = default
+
+    # Canonical value for one distinct input value, None for missing values
+    def normalize_value(self, value):
+        if pd.isna(value):
+            return None
+        canonical = self.lookup.get(fold(value))
+        if canonical is not None:
+            return canonical
+        if self.default is not None:
+            return self.default
+        return ' '.join(str(value).split())
+
+    # Normalize a column, returning a categorical with sorted categories
+    def __call__(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            uniques = series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series)
+
+        # Only values that occur become categories, as with astype('category')
+        present = np.bincount(codes[codes >= 0], minlength=len(uniques)) > 0
+        mapped = [self.normalize_value(value) if used else None for value, used in zip(uniques, present)]
+        categories = sorted({value for value in mapped if value is not None})
+        position = {value: i for i, value in enumerate(categories)}
+
+        # The extra trailing -1 maps missing values (code -1) to missing
+        lookup = np.array([position[value] if value is not None else -1 for value in mapped] + [-1])
+        new_codes = lookup[codes]
+        return pd.Series(pd.Categorical.from_codes(new_codes, categories), index=series.index, name=series.name)
@@ -0,0 +1,230 @@
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+
+# Reductions the executor can split by row range, with how their partial results
+# combine. nunique cannot be combined, so a call asking for it hash-partitions the
+# rows by key instead, putting every group in exactly one partition
+COMBINE = {'sum': 'sum', 'count': 'sum', 'size': 'sum', 'min': 'min', 'max': 'max'}
+REDUCTIONS = set(COMBINE) | {'nunique'}
+
+# Frames smaller than this are aggregated in-process, where a pool costs more than it saves
+PARALLEL_MIN_ROWS = 200_000
+
+# Worker processes used when a call does not say, set with set_workers; 1 keeps
+# every aggregation in-process
+_workers = 1
+
+# Pool kept between calls, with the number of workers it was started with
+_pool = None
+_pool_workers = None
+
+
+def set_workers(workers):
+    global _workers
+    _workers = max(int(workers or 1), 1)
+
+
+# Workers are forked: spawned workers would re-run the dashboard scripts, which have
+# no __main__ guard around their top-level code. Without fork, aggregation stays serial
+def start_method():
+    return 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+
+
+def _executor(workers):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(start_method()))
+        _pool_workers = workers
+    return _pool
+
+
+@atexit.register
+def _shutdown():
+    if _pool is not None:
+        _pool.shutdown()
+
+
+# Split a column into plain numpy arrays that can live in shared memory, and the
+# small metadata needed to rebuild it. Text columns are factorized into sorted codes
+# so their groups and min/max come out as with the original values
+def _encode(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return {'codes': series.cat.codes.to_numpy()}, ('category', dtype)
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufmM':
+        return {'values': series.to_numpy()}, ('numpy', dtype)
+    if isinstance(series.array, (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)):
+        values = series.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+        return {'values': values, 'mask': series.isna().to_numpy()}, ('masked', dtype)
+    codes, uniques = pd.factorize(series, sort=True)
+    return {'codes': codes}, ('factorized', pd.CategoricalDtype(uniques, ordered=True), dtype)
+
+
+def _decode(arrays, meta):
+    if meta[0] == 'category':
+        return pd.Categorical.from_codes(arrays['codes'], dtype=meta[1])
+    if meta[0] == 'numpy':
+        return arrays['values']
+    if meta[0] == 'masked':
+        return pd.array([], dtype=meta[1]).__class__(arrays['values'], arrays['mask'])
+    return pd.Categorical.from_codes(arrays['codes'], dtype=meta[1])
+
+
+# Copy columns into shared memory in row order, as plain arrays. Returns the block of
+# every array, the metadata to decode each column and the blocks to release
+def _share(df, columns):
+    blocks, metas, owned = {}, {}, []
+    try:
+        for column in columns:
+            arrays, metas[column] = _encode(df[column])
+            blocks[column] = {}
+            for part, values in arrays.items():
+                blocks[column][part] = _shared_array(len(values), values.dtype, owned)
+                name, dtype, length = blocks[column][part]
+                np.copyto(np.ndarray(length, dtype=dtype, buffer=owned[-1].buf), values)
+    except BaseException:
+        _release(owned)
+        raise
+    return blocks, metas, owned
+
+
+# Allocate a shared array, adding its block to owned. Returns what attaches to it
+def _shared_array(length, dtype, owned):
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(length * dtype.itemsize, 1))
+    owned.append(block)
+    return block.name, dtype, length
+
+
+def _release(owned):
+    for block in owned:
+        block.close()
+        block.unlink()
+
+
+# Rows of the shared columns as a frame: the range of a slice, or the rows at an array
+# of positions. The blocks are read in place and the frame keeps its own copy of just
+# those rows, so they are closed as soon as it is built
+def _frame(blocks, metas, columns, rows):
+    attached = []
+    try:
+        data = {}
+        for column in columns:
+            arrays = {}
+            for part, (name, dtype, length) in blocks[column].items():
+                block = shared_memory.SharedMemory(name=name)
+                attached.append(block)
+                arrays[part] = np.ndarray(length, dtype=dtype, buffer=block.buf)[rows]
+            data[column] = _decode(arrays, metas[column])
+        df = pd.DataFrame(data, copy=True)
+        del data, arrays
+        return df
+    finally:
+        for block in attached:
+            block.close()
+
+
+# Partial aggregate over rows [start, end)
+def _aggregate_range(blocks, metas, start, end, keys, named, dropna):
+    df = _frame(blocks, metas, list(blocks), slice(start, end))
+    return df.groupby(keys, observed=True, dropna=dropna).agg(**named)
+
+
+# Write the partition of each of rows [start, end), from a hash of its keys
+def _hash_range(blocks, metas, partitions, start, end, keys, count):
+    hashes = pd.util.hash_pandas_object(_frame(blocks, metas, keys, slice(start, end)), index=False).to_numpy()
+    name, dtype, length = partitions
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        np.ndarray(length, dtype=dtype, buffer=block.buf)[start:end] = hashes % np.uint64(count)
+    finally:
+        block.close()
+
+
+# Aggregate of the rows hashed to partition, whose groups no other partition holds
+def _aggregate_partition(blocks, metas, partitions, partition, keys, named, dropna):
+    name, dtype, length = partitions
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        positions = np.flatnonzero(np.ndarray(length, dtype=dtype, buffer=block.buf) == partition)
+    finally:
+        block.close()
+    df = _frame(blocks, metas, list(blocks), positions)
+    return df.groupby(keys, observed=True, dropna=dropna).agg(**named)
+
+
+# Combine partial aggregates of row ranges into the aggregate of all their rows
+def _combine(partials, named, dropna):
+    agg = pd.concat(partials)
+    levels = list(range(agg.index.nlevels)) if agg.index.nlevels > 1 else 0
+    return agg.groupby(level=levels, observed=True, dropna=dropna).agg(
+        {output: COMBINE[reduction] for output, (_, reduction) in named.items()})
+
+
+# df.groupby(keys, observed=True, dropna=dropna).agg(**named) spread over worker
+# processes. The parent only copies the needed columns into shared memory, in row
+# order; all the per-row work happens in the workers. Each worker aggregates one
+# contiguous range of rows and the partial results, one row per group and range, are
+# combined. A call asking for nunique takes two rounds instead: workers hash the keys
+# of their range into partitions, then each aggregates the rows of one partition,
+# which holds whole groups, and the results are concatenated in group order.
+# Falls back to a plain groupby for small frames, one worker or no fork support
+def parallel_groupby(df, keys, named, workers=None, dropna=True):
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    workers = _workers if workers is None else workers
+    unsupported = {reduction for _, reduction in named.values()} - REDUCTIONS
+    if unsupported:
+        raise ValueError(f'Unsupported reductions {", ".join(sorted(unsupported))}, '
+                         f'expected some of {", ".join(sorted(REDUCTIONS))}')
+    if not workers or workers <= 1 or len(df) < PARALLEL_MIN_ROWS or start_method() is None:
+        return df.groupby(keys, observed=True, dropna=dropna).agg(**named)
+
+    with stage('parallel_groupby', rows_in=len(df)) as rows:
+        columns = list(dict.fromkeys(keys + [column for column, _ in named.values()]))
+        with stage('share_columns'):
+            blocks, metas, owned = _share(df, columns)
+        try:
+            pool = _executor(workers)
+            bounds = np.linspace(0, len(df), workers + 1).astype('int64')
+            ranges = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+            if any(reduction == 'nunique' for _, reduction in named.values()):
+                partitions = _shared_array(len(df), np.min_scalar_type(workers - 1), owned)
+                for future in [pool.submit(_hash_range, blocks, metas, partitions, start, end, keys, workers)
+                               for start, end in ranges]:
+                    future.result()
+                futures = [pool.submit(_aggregate_partition, blocks, metas, partitions, partition, keys, named,
+                                       dropna) for partition in range(workers)]
+                partials = [future.result() for future in futures]
+                with stage('combine'):
+                    agg = pd.concat(partials).sort_index()
+            else:
+                futures = [pool.submit(_aggregate_range, blocks, metas, start, end, keys, named, dropna)
+                           for start, end in ranges]
+                partials = [future.result() for future in futures]
+                with stage('combine'):
+                    agg = _combine(partials, named, dropna)
+        finally:
+            _release(owned)
+
+        # Text columns went through categorical codes; give them back their dtype
+        if isinstance(agg.index, pd.MultiIndex):
+            agg.index = agg.index.set_levels([
+                level.astype(metas[key][2]) if metas[key][0] == 'factorized' else level
+                for key, level in zip(keys, agg.index.levels)
+            ])
+        elif metas[keys[0]][0] == 'factorized':
+            agg.index = agg.index.astype(metas[keys[0]][2])
+        for output, (column, reduction) in named.items():
+            if metas[column][0] == 'factorized' and reduction in ('min', 'max'):
+                agg[output] = agg[output].astype(metas[column][2])
+        rows.rows_out = len(agg)
+    return agg
@@ -1,166 +1,329 @@
-import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from dash import Dash, dcc, html, dash_table
+from dash import Dash, Input, Output, dcc, html, dash_table
 import os
+import threading
 
-# Function to correct swapped Age and Gender values
-def correct_age_gender(df, age_col='Age', gender_col='Gender'):
-    def correct_row(row):
-        age, gender = row[age_col], row[gender_col]
+import pandas as pd
 
-        try:
-            age = int(age)
-        except (ValueError, TypeError):
-            pass
+from aggregation import SEGMENT_KEYS, aggregate_segments
+from bucketing import DEFAULT_AGE_SCHEME, age_buckets
+from cleaning import CLEANING_VERSION, clean_social_media
+from cube import AGE_MAX, AGE_MIN
+from dedup import DEFAULT_KEYS, format_dedup_report
+from figures import cached_figure
+from filtering import FilterError, compile_filter
+from incremental import refresh_state
+from instrumentation import finish_run, stage, start_run
+from parallel import set_workers
+from ranking import PagedTable
+from schema import format_memory_report, memory_report
+from validation import ValidationReport, format_validation_report
 
-        if isinstance(age, int) and (0 <= age <= 120):
-            return age, gender
+# Define the absolute path to the CSV file
+csv_input_path = os.path.abspath('../test.csv')
 
-        try:
-            potential_age = int(gender)
-            if 0 <= potential_age <= 120:
-                return potential_age, age
-        except (ValueError, TypeError):
-            pass
+# Default order of the segment table, as (column, ascending) pairs
+SEGMENT_ORDER = [('Likes_Received_Per_Day', False), ('Messages_Sent_Per_Day', False), ('Posts_Per_Day', False)]
 
-        return row[age_col], row[gender_col]
 
-    df[age_col], df[gender_col] = zip(*df.apply(correct_row, axis=1))
-    return df
+# Everything the page shows, derived from the refreshed cube: every figure and table
+# is a roll-up of its cells
+class DashboardAggregates:
+    def __init__(self, state):
+        cube = state.cube
+        if state.dedup_report is not None:
+            print(format_dedup_report(state.dedup_report))
+        print(f"Aggregates ready ({state.rows_applied} unique rows)")
+        print(f"Distinct users per platform: {state.users_by_platform.counts().to_dict()}")
+        print(f"Distinct users per emotion: {state.users_by_emotion.counts().to_dict()}")
 
-# Define the absolute path to the CSV file
-csv_input_path = os.path.abspath('../test.csv')
-print(f"CSV Input Path: {csv_input_path}")
-
-# Create DataFrame
-df = pd.read_csv(csv_input_path, encoding='utf-8')
-print("DataFrame loaded successfully")
-
-# Correct Age and Gender columns
-df = correct_age_gender(df)
-print("Age and Gender columns corrected")
-
-# Ensure Age column contains only numeric values and convert to int
-df['Age'] = pd.to_numeric(df['Age'], errors='coerce').fillna(0).astype(int)
-
-# Handle incorrect gender entries, assume valid genders are 'Male', 'Female', 'Other'
-valid_genders = ['Male', 'Female', 'Other']
-df['Gender'] = df['Gender'].apply(lambda x: x if x in valid_genders else 'Other')
-
-# Create age ranges
-bins = [0, 18, 30, 45, 60, 120]
-labels = ['0-18', '19-30', '31-45', '46-60', '60+']
-df['Age Range'] = pd.cut(df['Age'], bins=bins, labels=labels, right=False, include_lowest=True)
-
-# Remove duplicates
-df = df.drop_duplicates()
-
-# Calculate total metrics
-total_likes = df['Likes_Received_Per_Day'].sum()
-total_messages = df['Messages_Sent_Per_Day'].sum()
-total_platforms = df['Platform'].nunique()
-age_range = f"{df['Age'].min()} - {df['Age'].max()}"
-
-print(f"Total Likes: {total_likes}")
-print(f"Total Messages: {total_messages}")
-print(f"Total Platforms: {total_platforms}")
-
-# Calculate likes and messages by platform
-likes_by_platform = df.groupby('Platform')['Likes_Received_Per_Day'].sum().reset_index()
-messages_by_platform = df.groupby('Platform')['Messages_Sent_Per_Day'].sum().reset_index()
-
-# Combine data for likes and messages
-agg_data = pd.merge(likes_by_platform, messages_by_platform, on='Platform')
-
-# Aggregate data by age range, gender, platform, and dominant emotion
-agg_age_range_gender_platform = df.groupby(['Age Range', 'Gender', 'Platform', 'Dominant_Emotion']).agg({
-    'Likes_Received_Per_Day': 'sum',
-    'Messages_Sent_Per_Day': 'sum',
-    'Posts_Per_Day': 'sum'
-}).reset_index()
-
-# Remove rows where all numerical values are zero or NaN
-agg_age_range_gender_platform = agg_age_range_gender_platform.replace(0, pd.NA)  # Replace zeros with NA
-agg_age_range_gender_platform = agg_age_range_gender_platform.dropna(subset=['Likes_Received_Per_Day', 'Messages_Sent_Per_Day', 'Posts_Per_Day'], how='all')
-
-# Sort by Likes_Received_Per_Day, Messages_Sent_Per_Day, and Posts_Per_Day in descending order
-agg_age_range_gender_platform = agg_age_range_gender_platform.sort_values(
-    by=['Likes_Received_Per_Day', 'Messages_Sent_Per_Day', 'Posts_Per_Day'],
-    ascending=[False, False, False]
-)
-
-# Initialize Dash app
-app = Dash(__name__)
-
-app.layout = html.Div([
-    html.H1(['Social Media Usage Dashboard'], style={'textAlign': 'center'}),
-
-    html.Div([
-        dcc.Graph(
-            figure=go.Figure(go.Indicator(
-                mode="number",
-                value=total_likes,
-                title={"text": "Total Likes", "font": {"size": 20}, "align": "center"},
-                number={"font": {"size": 40}},
-                domain={'x': [0, 1], 'y': [0, 1]}
-            )),
-            style={'display': 'inline-block', 'width': '24%', 'padding': '0', 'margin': '0', 'height': '150px'}
-        ),
-        dcc.Graph(
-            figure=go.Figure(go.Indicator(
-                mode="number",
-                value=total_messages,
-                title={"text": "Total Messages", "font": {"size": 20}, "align": "center"},
-                number={"font": {"size": 40}},
-                domain={'x': [0, 1], 'y': [0, 1]}
-            )),
-            style={'display': 'inline-block', 'width': '24%', 'padding': '0', 'margin': '0', 'height': '150px'}
-        ),
-        dcc.Graph(
-            figure=go.Figure(go.Indicator(
-                mode="number",
-                value=total_platforms,
-                title={"text": "Total Platforms", "font": {"size": 20}, "align": "center"},
-                number={"font": {"size": 40}},
-                domain={'x': [0, 1], 'y': [0, 1]}
-            )),
-            style={'display': 'inline-block', 'width': '24%', 'padding': '0', 'margin': '0', 'height': '150px'}
-        ),
-        dcc.Graph(
-            figure=go.Figure(go.Indicator(
-                mode="number",
-                value=df['Age'].max(),
-                title={"text": f"Age Range: {age_range}", "font": {"size": 20}, "align": "center"},
-                number={"font": {"size": 40}},
-                domain={'x': [0, 1], 'y': [0, 1]}
-            )),
-            style={'display': 'inline-block', 'width': '24%', 'padding': '0', 'margin': '0', 'height': '150px'}
-        ),
-    ], style={'textAlign': 'center', 'display': 'flex', 'justify-content': 'space-around'}),
-
-    html.Div([
-        dcc.Graph(
-            id='likes-messages-platform',
-            figure=px.line(agg_data, x='Platform', y=['Likes_Received_Per_Day', 'Messages_Sent_Per_Day'],
-                           labels={'value': 'Total', 'variable': 'Metric'},
-                           title='Total Likes and Messages by Platform')
-        ),
-    ]),
-
-    html.Div([
-        html.H2('Data Table'),
-        dash_table.DataTable(
-            id='data-table',
-            columns=[{"name": i, "id": i} for i in agg_age_range_gender_platform.columns],
-            data=agg_age_range_gender_platform.to_dict('records'),
-            page_size=10,
-            sort_action='native',  # Enable sorting
-            sort_by=[{'column_id': 'Likes_Received_Per_Day', 'direction': 'desc'}],  # Initial sort
-        ),
-    ]),
-])
+        # Calculate total metrics
+        totals = cube.totals()
+        self.total_likes = totals['Likes_Received_Per_Day']
+        self.total_messages = totals['Messages_Sent_Per_Day']
+        self.total_platforms = cube.distinct('Platform')
+        self.age_max = totals[AGE_MAX]
+        self.age_range = f"{totals[AGE_MIN]} - {self.age_max}"
+
+        print(f"Total Likes: {self.total_likes}")
+        print(f"Total Messages: {self.total_messages}")
+        print(f"Total Platforms: {self.total_platforms}")
+
+        # Calculate likes and messages by platform
+        self.agg_data = cube.rollup(['Platform'], ['Likes_Received_Per_Day', 'Messages_Sent_Per_Day'])
+
+        # Percentiles of usage time, likes and messages by platform, from the per-platform digests
+        print(state.distributions.summary().round(1).T.to_string())
+        self.usage_percentiles = state.distributions.summary((0.01, 0.25, 0.5, 0.75, 0.99))
+
+        # Aggregate data by age range, gender, platform, and dominant emotion,
+        # keeping only combinations with at least one non-zero value
+        segments = aggregate_segments(
+            cube.cells, ['Likes_Received_Per_Day', 'Messages_Sent_Per_Day', 'Posts_Per_Day']
+        )
+
+        # Rank by Likes_Received_Per_Day, Messages_Sent_Per_Day, and Posts_Per_Day in descending order.
+        # The table is served a page at a time in this order, which also breaks ties
+        # when a column is sorted on, so only the rows of the pages asked for are sorted
+        self.segment_table = PagedTable(segments, order=SEGMENT_ORDER)
+
+
+# Provider of the dashboard aggregates, loaded on the first page load or an explicit
+# warm_up rather than at import. Loading takes the fastest source available: the
+# persisted cube when the CSV is unchanged, the cube plus the appended rows when it
+# has grown, and the whole CSV only when no usable state is cached. The aggregates
+# are then kept for the life of the process, and threads serving requests share them
+class DashboardData:
+    def __init__(self, csv_path=csv_input_path, age_scheme=DEFAULT_AGE_SCHEME):
+        self.csv_path = csv_path
+        # Age ranges shown in the table
+        self.age_scheme = age_scheme
+        self.bucket_ages = age_buckets(age_scheme)
+        self._aggregates = None
+        self._lock = threading.Lock()
+
+    # Provider configured from the environment: DASHBOARD_AGE_SCHEME picks the age scheme
+    @classmethod
+    def from_env(cls):
+        return cls(csv_input_path, os.environ.get('DASHBOARD_AGE_SCHEME', DEFAULT_AGE_SCHEME))
+
+    def get(self):
+        if self._aggregates is None:
+            with self._lock:
+                if self._aggregates is None:
+                    self._aggregates = self._load()
+        return self._aggregates
+
+    # Load now, e.g. before a server starts taking requests
+    def warm_up(self):
+        self.get()
+        return self
+
+    # Clean rows read from the CSV and add age ranges
+    def prepare_rows(self, df):
+        print(f"{len(df)} new rows loaded")
+
+        # Validate the raw rows, then correct Age and Gender columns, Age types and Gender entries
+        validation = ValidationReport()
+        df = clean_social_media(df, validation)
+        print(format_validation_report(validation))
+        print("Age and Gender columns corrected")
+        print(format_memory_report(memory_report(df)))
+
+        # Create age ranges
+        with stage('age_ranges', rows_in=len(df)) as rows:
+            df['Age Range'] = self.bucket_ages(df['Age'])
+            rows.rows_out = len(df)
+        return df
+
+    # Update the persisted cube with the rows appended since it was saved, counting each
+    # User_ID once across the whole file. Each age scheme keeps its own state, so
+    # switching schemes does not discard the other
+    def _load(self):
+        print(f"CSV Input Path: {self.csv_path}")
+        with stage('refresh_state'):
+            state = refresh_state(self.csv_path, self.prepare_rows, name=f'plotly_app-{self.age_scheme}',
+                                  version=CLEANING_VERSION, dimensions=SEGMENT_KEYS, deduplicate=DEFAULT_KEYS)
+        return DashboardAggregates(state)
+
+
+# Rows per page of the data table
+TABLE_PAGE_SIZE = 10
+
+# Order the data table starts in
+TABLE_SORT_BY = [{'column_id': 'Likes_Received_Per_Day', 'direction': 'desc'}]
+
+
+# Rows of the data table its filter_query keeps. A query that does not parse, or names
+# a column the table does not have, is not applied, as with the DataTable's own filtering
+def filtered_table(table, filter_query):
+    try:
+        query = compile_filter(filter_query or '')
+        if query.tree is None or not query.columns <= set(table.df.columns):
+            return table
+        return table.where(query.key, query)
+    except FilterError:
+        return table
+
+
+# One page of the data table, as the records a DataTable takes, for its sort_by property
+def table_page(table, page, page_size, sort_by):
+    order = [(column['column_id'], column['direction'] == 'asc') for column in sort_by or []]
+    return table.page(page, page_size, order).to_dict('records')
+
+
+# Columns of the data table. Numeric ones are typed, so a bare value typed in their
+# filter cell is matched with '=' rather than 'contains'
+def table_columns(df):
+    return [
+        dict({"name": i, "id": i}, **({"type": 'numeric'} if pd.api.types.is_numeric_dtype(df[i].dtype) else {}))
+        for i in df.columns
+    ]
+
+
+# Headline number with its title
+def indicator_figure(value, title):
+    return go.Figure(go.Indicator(
+        mode="number",
+        value=value,
+        title={"text": title, "font": {"size": 20}, "align": "center"},
+        number={"font": {"size": 40}},
+        domain={'x': [0, 1], 'y': [0, 1]}
+    ))
+
+
+# plotly.express is imported here, as it is only needed when the figure is not cached
+def likes_messages_figure(agg_data):
+    import plotly.express as px
+
+    return px.line(agg_data, x='Platform', y=['Likes_Received_Per_Day', 'Messages_Sent_Per_Day'],
+                   labels={'value': 'Total', 'variable': 'Metric'},
+                   title='Total Likes and Messages by Platform')
+
+
+# Box plot of daily usage time by platform, drawn from precomputed percentiles
+def usage_box_figure(percentiles, column='Daily_Usage_Time (minutes)'):
+    fig = go.Figure(go.Box(
+        x=list(percentiles.index),
+        lowerfence=percentiles[f'{column} p1'],
+        q1=percentiles[f'{column} p25'],
+        median=percentiles[f'{column} p50'],
+        q3=percentiles[f'{column} p75'],
+        upperfence=percentiles[f'{column} p99'],
+        name=column,
+    ))
+    fig.update_layout(title='Daily Usage Time by Platform (whiskers at p1 and p99)', yaxis_title='Minutes')
+    return fig
+
+
+# Build the page layout from the aggregates. Figures are reused from the figure cache
+# while the aggregates behind them are unchanged
+def build_layout(aggregates):
+    return html.Div([
+        html.H1(['Social Media Usage Dashboard'], style={'textAlign': 'center'}),
+
+        html.Div([
+            dcc.Graph(
+                figure=cached_figure('indicator-likes', indicator_figure, aggregates.total_likes, "Total Likes"),
+                style={'display': 'inline-block', 'width': '24%', 'padding': '0', 'margin': '0', 'height': '150px'}
+            ),
+            dcc.Graph(
+                figure=cached_figure('indicator-messages', indicator_figure, aggregates.total_messages,
+                                     "Total Messages"),
+                style={'display': 'inline-block', 'width': '24%', 'padding': '0', 'margin': '0', 'height': '150px'}
+            ),
+            dcc.Graph(
+                figure=cached_figure('indicator-platforms', indicator_figure, aggregates.total_platforms,
+                                     "Total Platforms"),
+                style={'display': 'inline-block', 'width': '24%', 'padding': '0', 'margin': '0', 'height': '150px'}
+            ),
+            dcc.Graph(
+                figure=cached_figure('indicator-age', indicator_figure, aggregates.age_max,
+                                     f"Age Range: {aggregates.age_range}"),
+                style={'display': 'inline-block', 'width': '24%', 'padding': '0', 'margin': '0', 'height': '150px'}
+            ),
+        ], style={'textAlign': 'center', 'display': 'flex', 'justify-content': 'space-around'}),
+
+        html.Div([
+            dcc.Graph(
+                id='likes-messages-platform',
+                figure=cached_figure('likes-messages-platform', likes_messages_figure, aggregates.agg_data)
+            ),
+        ]),
+
+        html.Div([
+            dcc.Graph(
+                id='usage-platform',
+                figure=cached_figure('usage-platform', usage_box_figure, aggregates.usage_percentiles)
+            ),
+        ]),
+
+        html.Div([
+            html.H2('Data Table'),
+            # Only the first page is sent with the layout; the server sends every other
+            # page, sorts and filters through update_table
+            dash_table.DataTable(
+                id='data-table',
+                columns=table_columns(aggregates.segment_table.df),
+                data=table_page(aggregates.segment_table, 0, TABLE_PAGE_SIZE, TABLE_SORT_BY),
+                page_current=0,
+                page_size=TABLE_PAGE_SIZE,
+                page_count=aggregates.segment_table.page_count(TABLE_PAGE_SIZE),
+                page_action='custom',
+                sort_action='custom',  # Enable sorting
+                sort_mode='single',
+                sort_by=TABLE_SORT_BY,  # Initial sort
+                filter_action='custom',
+                filter_query='',
+            ),
+        ]),
+    ])
+
+
+# The components of the layout that have ids, without any data. Dash checks callbacks
+# against it, where it would otherwise call the layout function, loading the data,
+# as soon as the layout is set
+def layout_skeleton():
+    return html.Div([
+        dcc.Graph(id='likes-messages-platform'),
+        dcc.Graph(id='usage-platform'),
+        dash_table.DataTable(id='data-table'),
+    ])
+
+
+# Dash app serving the dashboard from data, by default a provider configured from the
+# environment. Creating it loads nothing: the layout is a function Dash calls on every
+# page load, and the first call loads the aggregates unless data was warmed up. A run
+# report, when DASHBOARD_REPORT or DASHBOARD_PROMETHEUS is set, covers the load and
+# the first layout
+def create_app(data=None):
+    if os.environ.get('DASHBOARD_REPORT') or os.environ.get('DASHBOARD_PROMETHEUS'):
+        start_run('plotly_app')
+
+    # Split large aggregations over DASHBOARD_WORKERS worker processes
+    set_workers(os.environ.get('DASHBOARD_WORKERS', 1))
+
+    data = data or DashboardData.from_env()
+    app = Dash(__name__)
+
+    def serve_layout():
+        aggregates = data.get()
+        with stage('build_layout'):
+            layout = build_layout(aggregates)
+        # Write the run report when DASHBOARD_REPORT or DASHBOARD_PROMETHEUS is set
+        finish_run(os.environ.get('DASHBOARD_REPORT'), os.environ.get('DASHBOARD_PROMETHEUS'))
+        return layout
+
+    app.validation_layout = layout_skeleton()
+    app.layout = serve_layout
+
+    # Filter, page and sort the data table on the server. The layout already holds the
+    # first page. A filter can leave fewer pages than the one shown, which then moves
+    # to the last page left
+    @app.callback(
+        Output('data-table', 'data'),
+        Output('data-table', 'page_count'),
+        Output('data-table', 'page_current'),
+        Input('data-table', 'page_current'),
+        Input('data-table', 'page_size'),
+        Input('data-table', 'sort_by'),
+        Input('data-table', 'filter_query'),
+        prevent_initial_call=True,
+    )
+    def update_table(page_current, page_size, sort_by, filter_query):
+        with stage('table_page'):
+            table = filtered_table(data.get().segment_table, filter_query)
+            page_count = table.page_count(page_size)
+            page = min(page_current or 0, max(page_count - 1, 0))
+            return table_page(table, page, page_size, sort_by), page_count, page
+
+    return app
+
+
+dashboard_data = DashboardData.from_env()
+app = create_app(dashboard_data)
 
 if __name__ == '__main__':
+    dashboard_data.warm_up()
     print("Starting Dash server")
-    app.run_server(debug=True)
+    app.run(debug=True)
@@ -0,0 +1,135 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# Rows of a frame ranked by several columns, compared lexicographically, served a page
+# at a time. Only the rows that can reach the requested page are sorted: the k-th
+# best value of the first column is found with a partial selection, rows worse than
+# it are discarded and the remaining candidates are sorted on every column. Ties on
+# every column keep the frame's order, as with sort_values. Categorical columns rank
+# in category order and other text columns alphabetically. Missing values rank last
+class Ranking:
+    def __init__(self, df, by, ascending=False):
+        self.df = df
+        self.by = list(by)
+        if isinstance(ascending, bool):
+            ascending = [ascending] * len(self.by)
+        if len(ascending) != len(self.by):
+            raise ValueError(f'Expected {len(self.by)} sort directions, got {len(ascending)}')
+        self.ascending = list(ascending)
+        # Positions of the best rows found so far, in rank order
+        self._order = np.empty(0, dtype='intp')
+
+    def __len__(self):
+        return len(self.df)
+
+    # A column as float64 values that sort in its order, missing values as NaN
+    def _values(self, column):
+        series = self.df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+        elif pd.api.types.is_numeric_dtype(series.dtype):
+            return series.to_numpy(dtype='float64', na_value=np.nan)
+        else:
+            codes = pd.factorize(series, sort=True)[0]
+        return np.where(codes < 0, np.nan, codes.astype('float64'))
+
+    # Keys where lower is better, with missing values last
+    def _keys(self, positions=None):
+        keys = []
+        for column, ascending in zip(self.by, self.ascending):
+            values = self._values(column)
+            if positions is not None:
+                values = values[positions]
+            values = values if ascending else -values
+            keys.append(np.where(np.isnan(values), np.inf, values))
+        return keys
+
+    # Positions of the k best rows, in rank order
+    def top_positions(self, k):
+        k = min(max(k, 0), len(self.df))
+        if k <= len(self._order):
+            return self._order[:k]
+
+        primary = self._keys()[0]
+        if k < len(primary):
+            kth = np.partition(primary, k - 1)[k - 1]
+            candidates = np.flatnonzero(primary <= kth)
+        else:
+            candidates = np.arange(len(primary))
+
+        # np.lexsort sorts by its last key first; positions break the remaining ties
+        keys = self._keys(candidates)
+        order = np.lexsort([candidates] + keys[::-1])
+        self._order = candidates[order[:k]]
+        return self._order
+
+    # The k best rows, in rank order
+    def top(self, k):
+        return self.df.iloc[self.top_positions(k)]
+
+    def page_count(self, page_size):
+        return -(-len(self.df) // page_size)
+
+    # Rows of page page (counting from 0) with page_size rows per page
+    def page(self, page, page_size):
+        start = page * page_size
+        return self.df.iloc[self.top_positions(start + page_size)[start:]]
+
+
+# Table served a page at a time in the order a client asks for, e.g. to a DataTable with
+# page_action='custom' and sort_action='custom', so only the rows of one page leave the
+# server. order, a list of (column, ascending) pairs, is the default order: it is
+# served when no order is asked for and breaks ties on the columns that are, then the
+# frame's order breaks the rest. Pages then match a client-side stable sort of the
+# frame sorted in the default order, without the frame ever being sorted whole.
+# A Ranking is kept per order asked for; a table has few columns, so they stay few.
+# Subsets of the rows, e.g. the rows a filter keeps, are tables of their own, and
+# the most recently used ones are kept with their rankings
+class PagedTable:
+    def __init__(self, df, max_subsets=128, order=()):
+        self.df = df.reset_index(drop=True)
+        self.max_subsets = max_subsets
+        self.order = [(column, bool(ascending)) for column, ascending in order]
+        self._rankings = {}
+        self._subsets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.df)
+
+    def page_count(self, page_size):
+        return -(-len(self.df) // page_size)
+
+    # Ranking for sort_by, a list of (column, ascending) pairs, followed by the columns
+    # of the default order that sort_by leaves out
+    def ranking(self, sort_by):
+        key = [(column, bool(ascending)) for column, ascending in sort_by]
+        sorted_on = {column for column, _ in key}
+        key = tuple(key + [(column, ascending) for column, ascending in self.order if column not in sorted_on])
+        if key not in self._rankings:
+            self._rankings[key] = Ranking(self.df, [column for column, _ in key], [ascending for _, ascending in key])
+        return self._rankings[key]
+
+    # Rows of page page (counting from 0), ordered by sort_by or in the default order
+    def page(self, page, page_size, sort_by=None):
+        if not sort_by and not self.order:
+            start = page * page_size
+            return self.df.iloc[start:start + page_size]
+        return self.ranking(sort_by or []).page(page, page_size)
+
+    # Table of the rows where mask(df) holds, with the same orders, kept under key
+    def where(self, key, mask):
+        with self._lock:
+            if key in self._subsets:
+                self._subsets.move_to_end(key)
+                return self._subsets[key]
+        subset = PagedTable(self.df[mask(self.df)], self.max_subsets, self.order)
+        with self._lock:
+            self._subsets[key] = subset
+            while len(self._subsets) > self.max_subsets:
+                self._subsets.popitem(last=False)
+        return subset
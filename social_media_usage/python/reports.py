@@ -0,0 +1,139 @@
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import util
+
+from bucketing import age_buckets
+from cache import atomic_write
+from cube import AGE_MAX, AGE_MIN, ROW_COUNT, Cube
+from export import ExportJob, ExportSession
+from figures import build_dashboard_figure, cached_figure
+from instrumentation import stage
+from parallel import start_method
+
+# Dimensions a dashboard is rendered for, one report per member of each
+REPORT_DIMENSIONS = ['Platform', 'Age Range', 'Dominant_Emotion']
+
+MANIFEST_NAME = 'manifest.json'
+
+# Renderer session of this worker process, started once and kept for every report it renders
+_session = None
+
+
+# File-name friendly form of a dimension or segment name, e.g. 'Age Range' -> 'age-range'
+def _slug(value):
+    return re.sub(r'[^a-z0-9+]+', '-', str(value).lower()).strip('-')
+
+
+# One segment's dashboard: the dimension and value selecting it, the file it is
+# written to and the inputs of build_dashboard_figure
+class SegmentReport:
+    def __init__(self, dimension, value, path, rows, inputs):
+        self.dimension = dimension
+        self.value = value
+        self.path = path
+        self.rows = rows
+        self.inputs = inputs
+
+
+# The dashboard inputs of every segment, from a single grouped pass over the rows: the
+# rows are reduced to a cube over every report dimension, and each segment's totals
+# and per-platform aggregates are read off the cells of its slice
+def plan_segment_reports(df, directory, dimensions=REPORT_DIMENSIONS, format='pdf', workers=None):
+    if 'Age Range' in dimensions and 'Age Range' not in df.columns:
+        df = df.assign(**{'Age Range': age_buckets()(df['Age'])})
+    cube = Cube.build(df, dimensions, workers=workers)
+
+    reports = []
+    for dimension in dimensions:
+        for value in cube.cells[dimension].dropna().drop_duplicates().sort_values():
+            segment = cube.slice({dimension: value})
+            totals = segment.totals()
+            inputs = (
+                totals['Likes_Received_Per_Day'],
+                totals['Messages_Sent_Per_Day'],
+                segment.distinct('Platform'),
+                totals[AGE_MIN],
+                totals[AGE_MAX],
+                segment.rollup(['Platform'], ['Likes_Received_Per_Day', 'Messages_Sent_Per_Day']),
+            )
+            path = os.path.join(directory, _slug(dimension), f'{_slug(value)}.{format}')
+            reports.append(SegmentReport(dimension, value, path, int(totals[ROW_COUNT]), inputs))
+    return reports
+
+
+def _start_worker():
+    global _session
+    _session = ExportSession().__enter__()
+    # Pool workers leave through os._exit, which skips atexit but runs finalizers
+    util.Finalize(_session, _session.__exit__, args=(None, None, None), exitpriority=10)
+
+
+# Build and export one report with this process's renderer session. Each segment's
+# figure is cached under its own name, so unchanged segments are not rebuilt
+def _render(report):
+    start = time.perf_counter()
+    figure = cached_figure(f'report-{_slug(report.dimension)}-{_slug(report.value)}',
+                           build_dashboard_figure, *report.inputs)
+    build_seconds = time.perf_counter() - start
+    os.makedirs(os.path.dirname(report.path) or '.', exist_ok=True)
+    result = _session.export(ExportJob(figure, report.path))
+    return {
+        'dimension': report.dimension,
+        'segment': str(report.value),
+        'path': report.path,
+        'rows': report.rows,
+        'build_seconds': round(build_seconds, 6),
+        'export_seconds': round(result.seconds, 6),
+        'seconds': round(build_seconds + result.seconds, 6),
+        'bytes': result.size,
+        'worker': os.getpid(),
+    }
+
+
+# Render every report across up to workers processes, each starting one renderer and
+# keeping it for all the reports it is handed, and write a manifest of how long each
+# report took next to them. Without fork, or with one worker, reports are rendered
+# in-process in a single renderer session
+def render_segment_reports(reports, directory, workers=1):
+    global _session
+    start = time.perf_counter()
+    with stage('render_reports', rows_in=len(reports)) as rows:
+        if workers > 1 and start_method() is not None and len(reports) > 1:
+            context = multiprocessing.get_context(start_method())
+            with ProcessPoolExecutor(min(workers, len(reports)), mp_context=context,
+                                     initializer=_start_worker) as pool:
+                entries = list(pool.map(_render, reports))
+        else:
+            with ExportSession() as _session:
+                entries = [_render(report) for report in reports]
+            _session = None
+        rows.rows_out = len(entries)
+
+    manifest = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'workers': workers,
+        'wall_seconds': round(time.perf_counter() - start, 6),
+        'reports': entries,
+    }
+    os.makedirs(directory, exist_ok=True)
+
+    def write(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    atomic_write(os.path.join(directory, MANIFEST_NAME), write)
+    return manifest
+
+
+def format_manifest(manifest):
+    reports = manifest['reports']
+    slowest = max(reports, key=lambda entry: entry['seconds'], default=None)
+    line = f'{len(reports)} segment reports in {manifest["wall_seconds"]:.2f}s with {manifest["workers"]} workers'
+    if slowest is not None:
+        line += f', slowest {slowest["path"]} ({slowest["seconds"]:.3f}s)'
+    return line
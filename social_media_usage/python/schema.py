@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+
+# Declared dtypes for a dataset. Low-cardinality text columns are categoricals and
+# counters are the smallest unsigned integers that hold them once cleaned. Columns
+# listed in raw_columns are read untyped because they need cleaning before they can be cast
+class Schema:
+    def __init__(self, columns, raw_columns=()):
+        self.columns = columns
+        self.raw_columns = set(raw_columns)
+
+    # Dtypes passed to pd.read_csv. Integers are read as nullable Int64, so missing
+    # values load as <NA> instead of turning the whole column into floats. They are
+    # only narrowed by apply, which checks the values fit: reading straight into a
+    # narrow or unsigned type would wrap values that do not, e.g. -5 into 4294967291
+    def read_dtypes(self):
+        dtypes = {}
+        for column, dtype in self.columns.items():
+            if column in self.raw_columns:
+                continue
+            dtypes[column] = dtype if dtype == 'category' else pd.Int64Dtype()
+        return dtypes
+
+    # Cast a cleaned frame to the declared dtypes. Integer columns without missing values
+    # use the plain numpy dtype, those with missing values keep the nullable one, and
+    # columns whose values do not fit the declared type are left as they are
+    def apply(self, df):
+        for column, dtype in self.columns.items():
+            if column not in df.columns:
+                continue
+            df[column] = _cast(df[column], dtype)
+        return df
+
+
+# Nullable pandas dtype for a numpy integer dtype name, e.g. 'uint16' -> 'UInt16'
+def _nullable(dtype):
+    if dtype != 'category' and np.dtype(dtype).kind in 'iu':
+        return pd.api.types.pandas_dtype(dtype.replace('uint', 'UInt').replace('int', 'Int'))
+    return dtype
+
+
+def _cast(series, dtype):
+    if dtype == 'category':
+        return series.astype('category')
+
+    info = np.iinfo(dtype)
+    values = pd.to_numeric(series, errors='coerce')
+    has_na = values.isna().any()
+    valid = values.dropna() if has_na else values
+    if len(valid) and (valid.min() < info.min or valid.max() > info.max):
+        return series
+    if has_na:
+        return values.astype(_nullable(dtype))
+    return values.astype(dtype)
+
+
+# Bytes a column would take with the dtypes pandas infers on its own: 8 bytes per
+# number, and for text the cost of each distinct value in pandas' default string
+# dtype times the number of times it occurs
+def _inferred_nbytes(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+        sizes = np.array([pd.Series([str(c)]).memory_usage(deep=True, index=False)
+                          for c in series.cat.categories], dtype='int64')
+        return int(counts @ sizes) + 8 * int((codes < 0).sum())
+    return 8 * len(series)
+
+
+# Per-column memory of a schema-typed frame next to the estimated memory of the same
+# data with inferred dtypes, with a total row
+def memory_report(df):
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'bytes': df.memory_usage(deep=True, index=False),
+        'inferred_bytes': pd.Series({column: _inferred_nbytes(df[column]) for column in df.columns}),
+    })
+    report.loc['Total'] = ['', report['bytes'].sum(), report['inferred_bytes'].sum()]
+    report['saved_bytes'] = report['inferred_bytes'] - report['bytes']
+    return report
+
+
+# One line summary of memory_report
+def format_memory_report(report):
+    total = report.loc['Total']
+    ratio = total['inferred_bytes'] / max(total['bytes'], 1)
+    return (f"Memory: {total['inferred_bytes'] / 1e6:.2f} MB inferred -> {total['bytes'] / 1e6:.2f} MB "
+            f"with schema ({total['saved_bytes'] / 1e6:.2f} MB saved, {ratio:.1f}x smaller)")
+
+
+# Schema of the social media usage export. Age and Gender can be swapped in the raw
+# file, and User_ID and the counters are validated on their raw values, where a
+# negative, fractional or text counter has to reach the quarantine rather than fail
+# the read, so all of them are only typed after cleaning
+SOCIAL_MEDIA_SCHEMA = Schema(
+    columns={
+        'User_ID': 'uint32',
+        'Age': 'uint8',
+        'Gender': 'category',
+        'Platform': 'category',
+        'Daily_Usage_Time (minutes)': 'uint16',
+        'Posts_Per_Day': 'uint16',
+        'Likes_Received_Per_Day': 'uint32',
+        'Comments_Received_Per_Day': 'uint32',
+        'Messages_Sent_Per_Day': 'uint32',
+        'Dominant_Emotion': 'category',
+    },
+    raw_columns=[
+        'User_ID',
+        'Age',
+        'Gender',
+        'Daily_Usage_Time (minutes)',
+        'Posts_Per_Day',
+        'Likes_Received_Per_Day',
+        'Comments_Received_Per_Day',
+        'Messages_Sent_Per_Day',
+    ],
+)
@@ -0,0 +1,289 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Relative standard error of the distinct counts when sketches are used
+DEFAULT_ERROR = 0.01
+
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+
+# 64-bit hashes of the values of a column, equal for equal values whatever the
+# dtype they were read with, in any process
+def hash_values(values):
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+
+
+# Hashes of the non-missing values, which are the ones distinct counts cover
+def _present_hashes(values):
+    return hash_values(pd.Series(values).dropna())
+
+
+# Number of significant bits of each 32-bit value, exact through float64
+def _bit_length32(values):
+    return np.frexp(values.astype('float64'))[1]
+
+
+# HyperLogLog sketch of the distinct values seen so far. Registers hold, for each of
+# 2**precision buckets picked by the top bits of a value's hash, the highest rank
+# (position of the first set bit) seen among the remaining bits. The estimate has
+# a relative standard error of about 1.04 / sqrt(2**precision), sketches of the same
+# precision merge by taking register maxima, and the registers are a plain byte array
+class HyperLogLog:
+    def __init__(self, precision=14):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f'Precision must be between {MIN_PRECISION} and {MAX_PRECISION}, got {precision}')
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype='uint8')
+
+    # Smallest sketch whose relative standard error is at most error
+    @classmethod
+    def for_error(cls, error=DEFAULT_ERROR):
+        precision = math.ceil(2 * math.log2(1.04 / error))
+        return cls(min(max(precision, MIN_PRECISION), MAX_PRECISION))
+
+    @property
+    def error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    # Add values, given by their 64-bit hashes
+    def update_hashes(self, hashes):
+        if not len(hashes):
+            return self
+        p = self.precision
+        bucket = (hashes >> np.uint64(64 - p)).astype('intp')
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        high = (rest >> np.uint64(32)).astype('uint32')
+        low = (rest & np.uint64(0xFFFFFFFF)).astype('uint32')
+        bits = np.where(high > 0, 32 + _bit_length32(high), _bit_length32(low))
+        rank = (64 - p - bits + 1).astype('uint8')
+        np.maximum.at(self.registers, bucket, rank)
+        return self
+
+    def update(self, values):
+        return self.update_hashes(_present_hashes(values))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(f'Cannot merge sketches of precision {self.precision} and {other.precision}')
+        merged = HyperLogLog(self.precision)
+        merged.registers = np.maximum(self.registers, other.registers)
+        return merged
+
+    def count(self):
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / np.ldexp(1.0, -self.registers.astype('int64')).sum()
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Small cardinalities are counted from the empty registers instead
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls(data[0])
+        sketch.registers = np.frombuffer(data[1:], dtype='uint8').copy()
+        return sketch
+
+
+# Exact distinct count with the same interface, keeping every distinct hash. Memory
+# grows with the number of distinct values, so it suits small inputs
+class ExactDistinct:
+    error = 0.0
+
+    def __init__(self):
+        self.hashes = np.empty(0, dtype='uint64')
+
+    def update_hashes(self, hashes):
+        self.hashes = np.union1d(self.hashes, hashes)
+        return self
+
+    def update(self, values):
+        return self.update_hashes(_present_hashes(values))
+
+    def merge(self, other):
+        merged = ExactDistinct()
+        merged.hashes = np.union1d(self.hashes, other.hashes)
+        return merged
+
+    def count(self):
+        return len(self.hashes)
+
+    def to_bytes(self):
+        return self.hashes.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        counter = cls()
+        counter.hashes = np.frombuffer(data, dtype='uint64').copy()
+        return counter
+
+
+# Exact counter when error is None, otherwise a sketch within that relative error
+def distinct_counter(error=None):
+    return ExactDistinct() if error is None else HyperLogLog.for_error(error)
+
+
+# Distinct values of one column within each group of another, e.g. distinct users
+# per platform. Values are hashed once per chunk and each group's hashes go to its
+# own counter
+class GroupedDistinct:
+    def __init__(self, key, column, error=None):
+        self.key = key
+        self.column = column
+        self.error = error
+        self.counters = {}
+
+    def update(self, df):
+        if not len(df):
+            return self
+        hashes = hash_values(df[self.column])
+        present = df[self.column].notna().to_numpy()
+        for group, positions in df.groupby(self.key, observed=True).indices.items():
+            positions = positions[present[positions]]
+            if group not in self.counters:
+                self.counters[group] = distinct_counter(self.error)
+            self.counters[group].update_hashes(hashes[positions])
+        return self
+
+    def merge(self, other):
+        merged = GroupedDistinct(self.key, self.column, self.error)
+        merged.counters = dict(self.counters)
+        for group, counter in other.counters.items():
+            merged.counters[group] = counter.merge(merged.counters[group]) if group in merged.counters else counter
+        return merged
+
+    # Distinct count of every group, as a Series indexed by group
+    def counts(self):
+        groups = sorted(self.counters)
+        return pd.Series([self.counters[group].count() for group in groups],
+                         index=pd.Index(groups, name=self.key), name=self.column, dtype='int64')
+
+
+# Default t-digest compression: at most about half as many centroids are kept
+DEFAULT_COMPRESSION = 200
+
+# Quantiles reported per group
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+# Merging t-digest of the values seen so far. Values are kept as weighted centroids,
+# sorted by mean; after every update centroids are merged so that each one covers at
+# most one unit of the arcsine scale function, which keeps about compression / 2
+# centroids whatever the number of values, with small centroids near the tails so
+# extreme quantiles stay accurate. Digests merge by compressing their centroids together
+class TDigest:
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0, dtype='float64')
+        self.weights = np.empty(0, dtype='float64')
+        self.min = np.nan
+        self.max = np.nan
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def _add(self, means, weights, low, high):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+
+        # Centroids falling in the same unit of the scale function are merged
+        q_left = (np.cumsum(weights) - weights) / weights.sum()
+        scale = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q_left - 1))
+        starts = np.flatnonzero(np.r_[True, scale[1:] != scale[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+        self.min = np.fmin(self.min, low)
+        self.max = np.fmax(self.max, high)
+        return self
+
+    # Add values, ignoring missing ones
+    def update(self, values):
+        values = pd.Series(values).dropna().to_numpy(dtype='float64')
+        if not len(values):
+            return self
+        return self._add(values, np.ones(len(values)), values.min(), values.max())
+
+    def merge(self, other):
+        merged = TDigest(self.compression)
+        merged.means, merged.weights = self.means, self.weights
+        merged.min, merged.max = self.min, self.max
+        if not len(other.weights):
+            return merged
+        return merged._add(other.means, other.weights, other.min, other.max)
+
+    # Estimated quantiles, interpolating between centroid centres and the exact extremes.
+    # While every centroid is still a single value they are exact, as with np.quantile
+    def quantiles(self, qs=DEFAULT_QUANTILES):
+        qs = np.asarray(qs, dtype='float64')
+        if not len(self.weights):
+            return np.full(len(qs), np.nan)
+        if (self.weights == 1).all():
+            return np.quantile(self.means, qs)
+        total = self.weights.sum()
+        centres = np.cumsum(self.weights) - self.weights / 2
+        positions = np.r_[0.0, centres, total]
+        values = np.r_[self.min, self.means, self.max]
+        return np.interp(qs * total, positions, values)
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def to_bytes(self):
+        header = np.array([self.compression, self.min, self.max], dtype='float64')
+        return np.concatenate([header, self.means, self.weights]).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        values = np.frombuffer(data, dtype='float64')
+        digest = cls(values[0])
+        digest.min, digest.max = values[1], values[2]
+        centroids = (len(values) - 3) // 2
+        digest.means = values[3:3 + centroids].copy()
+        digest.weights = values[3 + centroids:].copy()
+        return digest
+
+
+# Quantile digests of several columns within each group of a key column, e.g. usage
+# time, likes and messages per platform
+class GroupedQuantiles:
+    def __init__(self, key, columns, compression=DEFAULT_COMPRESSION):
+        self.key = key
+        self.columns = list(columns)
+        self.compression = compression
+        self.digests = {}
+
+    def update(self, df):
+        for group, positions in df.groupby(self.key, observed=True).indices.items():
+            digests = self.digests.setdefault(
+                group, {column: TDigest(self.compression) for column in self.columns})
+            for column in self.columns:
+                digests[column].update(df[column].to_numpy()[positions])
+        return self
+
+    def merge(self, other):
+        merged = GroupedQuantiles(self.key, self.columns, self.compression)
+        merged.digests = dict(self.digests)
+        for group, digests in other.digests.items():
+            if group in merged.digests:
+                digests = {column: merged.digests[group][column].merge(digest)
+                           for column, digest in digests.items()}
+            merged.digests[group] = digests
+        return merged
+
+    # One row per group and one column per column and quantile, e.g. 'Posts_Per_Day p90'
+    def summary(self, qs=DEFAULT_QUANTILES):
+        groups = sorted(self.digests)
+        names = [f'{column} p{q * 100:g}' for column in self.columns for q in qs]
+        rows = [np.concatenate([self.digests[group][column].quantiles(qs) for column in self.columns])
+                for group in groups]
+        return pd.DataFrame(rows, index=pd.Index(groups, name=self.key), columns=names)
@@ -0,0 +1,81 @@
+import pandas as pd
+
+from cleaning import clean_social_media
+from cube import DISTRIBUTION_COLUMNS
+from instrumentation import stage
+from loader import read_social_media
+from sketches import DEFAULT_ERROR, GroupedDistinct, GroupedQuantiles, distinct_counter
+
+LIKES = 'Likes_Received_Per_Day'
+MESSAGES = 'Messages_Sent_Per_Day'
+
+# Default number of CSV rows read per chunk in streaming mode
+DEFAULT_CHUNKSIZE = 100_000
+
+
+# Running totals behind the dashboard, folded in chunk by chunk so only the
+# current chunk and a few small aggregates are ever held in memory. Distinct counts
+# come from HyperLogLog sketches within distinct_error, or are exact when it is None,
+# which costs a merge of every seen value per chunk. Distributions per platform are
+# kept as t-digests, so their memory stays constant however many rows arrive
+class DashboardTotals:
+    def __init__(self, distinct_error=DEFAULT_ERROR):
+        self.total_likes = 0
+        self.total_messages = 0
+        self.platforms = distinct_counter(distinct_error)
+        self.users_by_platform = GroupedDistinct('Platform', 'User_ID', distinct_error)
+        self.users_by_emotion = GroupedDistinct('Dominant_Emotion', 'User_ID', distinct_error)
+        self.distributions = GroupedQuantiles('Platform', DISTRIBUTION_COLUMNS)
+        self.age_min = None
+        self.age_max = None
+        self.by_platform = None
+
+    # Fold a cleaned chunk into the running totals
+    def update(self, chunk):
+        if chunk.empty:
+            return self
+
+        self.total_likes += chunk[LIKES].sum()
+        self.total_messages += chunk[MESSAGES].sum()
+        self.platforms.update(chunk['Platform'])
+        self.users_by_platform.update(chunk)
+        self.users_by_emotion.update(chunk)
+        self.distributions.update(chunk)
+
+        age_min, age_max = chunk['Age'].min(), chunk['Age'].max()
+        self.age_min = age_min if self.age_min is None else min(self.age_min, age_min)
+        self.age_max = age_max if self.age_max is None else max(self.age_max, age_max)
+
+        # Partial per-platform sums, combined with the previous partials
+        partial = chunk.groupby('Platform', observed=True)[[LIKES, MESSAGES]].sum()
+        if self.by_platform is not None:
+            partial = pd.concat([self.by_platform, partial]).groupby(level=0).sum()
+        self.by_platform = partial
+        return self
+
+    @property
+    def total_platforms(self):
+        return self.platforms.count()
+
+    # Likes and messages by platform, laid out like the merged per-platform groupbys
+    def agg_data(self):
+        if self.by_platform is None:
+            return pd.DataFrame(columns=['Platform', LIKES, MESSAGES])
+        return self.by_platform.reset_index()
+
+
+# Stream the CSV in chunks, cleaning each one and folding it into the running totals.
+# Validation results of every chunk are added to validation when given
+def stream_totals(csv_path, chunksize=DEFAULT_CHUNKSIZE, validation=None, distinct_error=DEFAULT_ERROR):
+    totals = DashboardTotals(distinct_error)
+    reader = read_social_media(csv_path, chunksize=chunksize)
+    while True:
+        with stage('read_csv') as rows:
+            chunk = next(reader, None)
+            rows.rows_out = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return totals
+
+        chunk = clean_social_media(chunk, validation)
+        with stage('fold_chunk', rows_in=len(chunk)):
+            totals.update(chunk)
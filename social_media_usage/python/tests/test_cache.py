@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+import cache
+from cache import cache_path, cached_file_digest, load_cached, remove_stale
+
+pytestmark = pytest.mark.skipif(cache.pa is None, reason='needs pyarrow')
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / 'usage.csv'
+    path.write_text('a,b\n1,2\n', encoding='utf-8')
+    return str(path)
+
+
+def test_files_removed_by_another_process_are_skipped(tmp_path, monkeypatch):
+    kept = tmp_path / 'frame-v2.arrow'
+    kept.write_bytes(b'')
+    # Matched, then removed by another process before this one gets to it
+    monkeypatch.setattr(cache.glob, 'glob', lambda pattern: [str(tmp_path / 'frame-v1.arrow'), str(kept)])
+
+    remove_stale(str(tmp_path / 'frame-v*.arrow'), str(kept))
+
+    assert kept.exists()
+
+
+@pytest.mark.parametrize('entry', [None, b'', b'not an arrow file'])
+def test_unreadable_entries_are_misses(tmp_path, csv_path, entry):
+    cache_dir = str(tmp_path / 'cache')
+    if entry is not None:
+        path = cache_path('test', cached_file_digest(csv_path, cache_dir), 1, cache_dir)
+        with open(path, 'wb') as f:
+            f.write(entry)
+    builds = []
+
+    def build(path):
+        builds.append(path)
+        return pd.read_csv(path)
+
+    first = load_cached(csv_path, build, 'test', 1, cache_dir)
+    second = load_cached(csv_path, build, 'test', 1, cache_dir)
+
+    assert builds == [csv_path]
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_figures_survive_concurrent_cleanup(tmp_path, monkeypatch):
+    figures = pytest.importorskip('figures')
+
+    def build(value):
+        return figures.go.Figure(figures.go.Indicator(mode='number', value=value))
+
+    first = figures.cached_figure('test', build, 1, cache_dir=str(tmp_path))
+    # Another process removed this figure after matching it as stale
+    monkeypatch.setattr(cache.glob, 'glob', lambda pattern: [str(tmp_path / 'gone.json')])
+    monkeypatch.setattr(figures, '_figures', {})
+
+    assert figures.cached_figure('test', build, 2, cache_dir=str(tmp_path)) != first
@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import legacy_correct_age_gender, make_frame
+from cleaning import clean_social_media, correct_age_gender
+from loader import BACKENDS, read_social_media
+from sketches import ExactDistinct, HyperLogLog
+from streaming import stream_totals
+from validation import ValidationReport
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'test.csv')
+
+HEADER = ('User_ID,Age,Gender,Platform,Daily_Usage_Time (minutes),Posts_Per_Day,Likes_Received_Per_Day,'
+          'Comments_Received_Per_Day,Messages_Sent_Per_Day,Dominant_Emotion\n')
+
+# A valid row, then counters that are negative, fractional, text and too large to
+# fit the declared dtype
+ROWS = [
+    '1,25,Female,Instagram,120,3,40,2,4,Happiness\n',
+    '2,25,Female,Instagram,120,3,-5,2,4,Happiness\n',
+    '3,30,Male,Twitter,60,2,1.5,1,3,Anger\n',
+    '4,30,Male,Twitter,60,abc,7,1,3,Anger\n',
+    '5,30,Male,Twitter,60,2,5000000000,1,3,Anger\n',
+]
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / 'usage.csv'
+    path.write_text(HEADER + ''.join(ROWS), encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_bad_counters_are_quarantined(csv_path, backend):
+    validation = ValidationReport()
+    df = clean_social_media(read_social_media(csv_path, backend=backend), validation)
+
+    assert df['User_ID'].tolist() == [1, 5]
+    # Too large for uint32, so it keeps a wide type instead of wrapping around
+    assert df['Likes_Received_Per_Day'].tolist() == [40, 5000000000]
+    failed = dict(zip(validation.quarantine['User_ID'], validation.quarantine['Failed_Rules']))
+    assert failed == {
+        2: 'Likes_Received_Per_Day_negative',
+        3: 'Likes_Received_Per_Day_not_integer',
+        4: 'Posts_Per_Day_not_integer',
+    }
+
+
+def test_bad_counters_are_quarantined_per_chunk(csv_path):
+    validation = ValidationReport()
+    totals = stream_totals(csv_path, chunksize=2, validation=validation)
+
+    assert totals.total_likes == 40 + 5000000000
+    assert sorted(validation.quarantine['User_ID']) == [2, 3, 4]
+
+
+def test_distinct_users_are_sketched_unless_exact_is_asked_for(csv_path):
+    sketched = stream_totals(csv_path, chunksize=2)
+    exact = stream_totals(csv_path, chunksize=2, distinct_error=None)
+
+    assert isinstance(sketched.platforms, HyperLogLog)
+    assert isinstance(exact.platforms, ExactDistinct)
+    assert sketched.users_by_platform.counts().to_dict() == exact.users_by_platform.counts().to_dict()
+
+
+def test_quarantine_is_written_on_every_run(csv_path, tmp_path, monkeypatch):
+    import main
+
+    quarantine = tmp_path / 'quarantine.csv'
+    for _ in range(2):
+        monkeypatch.setattr(main, 'validation', ValidationReport())
+        monkeypatch.setattr(main, 'csv_input_path', csv_path)
+        main.main(['aggregate', '--output', str(tmp_path / 'metrics.json'), '--quarantine', str(quarantine)])
+        assert sorted(pd.read_csv(quarantine)['User_ID']) == [2, 3, 4]
+        quarantine.unlink()
+
+
+def test_an_empty_quarantine_is_not_written(tmp_path, monkeypatch, capsys):
+    import main
+
+    monkeypatch.setattr(main, 'validation', ValidationReport())
+    main.finish_validation(main.build_parser().parse_args(['aggregate', '--quarantine', str(tmp_path / 'q.csv')]))
+
+    assert not (tmp_path / 'q.csv').exists()
+    assert 'no rows were validated' in capsys.readouterr().out
+
+
+# Values of a column with every missing value as None, so 30 and 30.0 compare equal
+def values(series):
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+@pytest.mark.parametrize('df', [
+    pd.read_csv(SAMPLE, encoding='utf-8'),
+    make_frame(10_000),
+], ids=['sample', 'synthetic'])
+def test_correct_age_gender_matches_the_row_wise_version(df):
+    pd.testing.assert_frame_equal(correct_age_gender(df.copy()), legacy_correct_age_gender(df.copy()))
+
+
+# The row-wise version builds every row as a Series, which upcasts ints to float when the
+# other column of the row is numeric with a missing value, and rebuilds both columns from
+# their values, so a text column left untouched but holding a missing value came back as
+# float. The vectorized version only rewrites the values it corrects: a column it does not
+# touch keeps its dtype, corrected ages are int64, or float64 alongside missing ages
+@pytest.mark.parametrize('age, gender, expected_age, expected_gender, dtypes', [
+    # Swapped
+    (['Female', '25'], ['30', 'Male'], [30, 25], ['Female', 'Male'], ('int64', 'str')),
+    # Out of range either way, so nothing is swapped
+    (['150', '-3'], ['Male', '200'], ['150', '-3'], ['Male', '200'], ('str', 'str')),
+    # int() strips whitespace
+    ([' 42 ', '30'], ['Male', ' 27 '], [42, 30], ['Male', ' 27 '], ('int64', 'str')),
+    # int() truncates floats
+    ([27.5, 30.0], ['Male', 'Female'], [27, 30], ['Male', 'Female'], ('int64', 'str')),
+    (['Male', '30'], [27.5, np.nan], [27, 30], ['Male', None], ('int64', 'str')),
+    # Missing ages stay missing
+    ([np.nan, '30'], ['Male', 'Female'], [None, 30], ['Male', 'Female'], ('float64', 'str')),
+    ([np.nan, 30.0], ['Male', 'Female'], [None, 30], ['Male', 'Female'], ('float64', 'str')),
+    # Untouched columns keep their dtype, where the row-wise version made both float64
+    ([-3, 40], [np.nan, np.nan], [-3, 40], [None, None], ('int64', 'float64')),
+    (['Female', np.nan], ['Male', np.nan], ['Female', None], ['Male', None], ('str', 'str')),
+])
+def test_correct_age_gender_cases(age, gender, expected_age, expected_gender, dtypes):
+    df = pd.DataFrame({'Age': age, 'Gender': gender})
+    result = correct_age_gender(df.copy())
+    legacy = legacy_correct_age_gender(df.copy())
+
+    assert values(result['Age']) == values(legacy['Age']) == expected_age
+    assert values(result['Gender']) == values(legacy['Gender']) == expected_gender
+    assert (str(result['Age'].dtype), str(result['Gender'].dtype)) == dtypes
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from filtering import FilterError, compile_filter, parse_filter
+from ranking import PagedTable
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'Age Range': pd.Categorical(['19-30', '31-45', '19-30', None], categories=['19-30', '31-45']),
+        'Platform': pd.array(['Instagram', 'Twitter', 'instagram', None], dtype='str'),
+        'Likes_Received_Per_Day': np.array([1234567, 1234568, 1234569, 10], dtype='uint32'),
+        'Code': pd.array(['1234567', '1234568', 'x', None], dtype='str'),
+    })
+
+
+def rows(df, query):
+    return np.flatnonzero(compile_filter(query)(df)).tolist()
+
+
+def test_parse_precedence_and_canonical_form():
+    tree = parse_filter('!{a} = 1 || {b} contains x && ({c} is blank)')
+    assert str(tree) == "(!({a} eq 1)) || (({b} contains 'x') && ({c} is blank))"
+    # The canonical form parses back to itself
+    assert str(parse_filter(str(tree))) == str(tree)
+    assert parse_filter('  ') is None
+
+
+@pytest.mark.parametrize('query', ['{a} =', '{a} foo 1', 'a = 1', '({a} = 1', '{a} = 1 {b} = 2', '{a} is odd x',
+                                   '{a} is weird', '"x'])
+def test_parse_errors(query):
+    with pytest.raises(FilterError):
+        parse_filter(query)
+
+
+def test_numbers_keep_their_text():
+    assert str(parse_filter('{x} > 1234567')) != str(parse_filter('{x} > 1234568'))
+    # Equal as numbers but not as text, so they must not share a cached table
+    assert str(parse_filter('{x} > 1e3')) != str(parse_filter('{x} > 1000'))
+    assert str(parse_filter('{x} = 60.0')) == '{x} eq 60.0'
+
+
+def test_masks(df):
+    assert rows(df, '{Likes_Received_Per_Day} > 1234567') == [1, 2]
+    assert rows(df, '{Likes_Received_Per_Day} > 1234568') == [2]
+    assert rows(df, '{Platform} = Instagram && {Likes_Received_Per_Day} >= 1234567') == [0]
+    assert rows(df, '{Platform} ieq INSTAGRAM') == [0, 2]
+    assert rows(df, '{Platform} ne Instagram') == [1, 2, 3]
+    assert rows(df, '{Age Range} = 19-30') == [0, 2]
+    assert rows(df, '{Age Range} is nil || {Platform} contains witt') == [1, 3]
+    assert rows(df, '{Likes_Received_Per_Day} is even') == [1, 3]
+    # Numbers compared with text columns keep the digits they were written with
+    assert rows(df, '{Code} = 1234567') == [0]
+    assert rows(df, '{Code} contains 12345678') == []
+
+
+def test_compiled_filters_are_cached():
+    assert compile_filter('{Platform} = Twitter') is compile_filter('{Platform} = Twitter')
+
+
+def test_filtered_tables_are_cached_per_query(df):
+    table = PagedTable(df)
+
+    def filtered(query):
+        compiled = compile_filter(query)
+        return table.where(compiled.key, compiled)
+
+    first = filtered('{Likes_Received_Per_Day} > 1234567')
+    assert filtered('{Likes_Received_Per_Day}   >   1234567') is first
+    second = filtered('{Likes_Received_Per_Day} > 1234568')
+    assert second is not first
+    assert len(first) == 2 and len(second) == 1
+
+
+def test_numbers_written_differently_are_cached_apart_on_text_columns(df):
+    table = PagedTable(df)
+
+    def filtered(query):
+        compiled = compile_filter(query)
+        return table.where(compiled.key, compiled)
+
+    assert filtered('{Code} = 1234567').df['Code'].tolist() == ['1234567']
+    assert len(filtered('{Code} = 1234567.0')) == 0
+    assert len(filtered('{Code} = 1.234567e6')) == 0
+    assert filtered('{Code} = 1234567').df['Code'].tolist() == ['1234567']
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from cleaning import CLEANING_VERSION, clean_social_media
+from dedup import DEFAULT_KEYS
+from incremental import load_state, refresh_state, state_path
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'test.csv')
+
+
+@pytest.fixture
+def lines():
+    with open(SAMPLE, 'rb') as f:
+        return f.read().rstrip(b'\n').split(b'\n')
+
+
+def refresh(csv_path, cache_dir, deduplicate=False):
+    return refresh_state(str(csv_path), clean_social_media, name='test', version=CLEANING_VERSION,
+                         dimensions=['Platform', 'Gender'], deduplicate=deduplicate, distinct_error=None,
+                         cache_dir=str(cache_dir))
+
+
+# Everything a state answers, in a form that compares equal however the cells were merged
+def summary(state):
+    rollup = state.cube.rollup(['Platform', 'Gender']).astype({'Platform': str, 'Gender': str})
+    return {
+        'totals': state.cube.totals().to_dict(),
+        'rollup': rollup.sort_values(['Platform', 'Gender']).reset_index(drop=True).to_dict('list'),
+        'users_by_platform': state.users_by_platform.counts().to_dict(),
+        'users_by_emotion': state.users_by_emotion.counts().to_dict(),
+        'rows_applied': state.rows_applied,
+    }
+
+
+def rebuilt(tmp_path, data, deduplicate=False):
+    path = tmp_path / 'full.csv'
+    path.write_bytes(data)
+    return refresh(path, tmp_path / 'full-cache', deduplicate)
+
+
+@pytest.mark.parametrize('deduplicate', [False, DEFAULT_KEYS])
+def test_appending_in_steps_matches_a_rebuild(tmp_path, lines, deduplicate):
+    path, cache_dir = tmp_path / 'usage.csv', tmp_path / 'cache'
+    header, rows = lines[0], lines[1:]
+    half = len(rows) // 2
+    # The last row is cut off halfway, as if it were still being written
+    steps = [
+        b'\n'.join([header] + rows[:10]) + b'\n',
+        b'\n'.join(rows[10:half]) + b'\n' + rows[half][:12],
+        rows[half][12:] + b'\n' + b'\n'.join(rows[half + 1:]) + b'\n',
+    ]
+
+    written = b''
+    for step in steps:
+        written += step
+        with open(path, 'ab') as f:
+            f.write(step)
+        state = refresh(path, cache_dir, deduplicate)
+        assert summary(state) == summary(rebuilt(tmp_path, written, deduplicate))
+
+    # Nothing appended: the persisted state is served as is
+    assert summary(refresh(path, cache_dir, deduplicate)) == summary(state)
+
+
+def test_the_unterminated_tail_is_not_persisted(tmp_path, lines):
+    path, cache_dir = tmp_path / 'usage.csv', tmp_path / 'cache'
+    complete = b'\n'.join(lines[:11]) + b'\n'
+    path.write_bytes(complete + lines[11][:12])
+
+    refresh(path, cache_dir)
+
+    assert load_state(state_path('test', str(cache_dir))).offset == len(complete)
+    # The tail is gone on the next read, so only the complete rows remain
+    path.write_bytes(complete)
+    assert summary(refresh(path, cache_dir)) == summary(rebuilt(tmp_path, complete))
+
+
+@pytest.mark.parametrize('rewrite', ['edited', 'truncated'])
+def test_a_rewritten_file_is_rebuilt(tmp_path, lines, rewrite):
+    path, cache_dir = tmp_path / 'usage.csv', tmp_path / 'cache'
+    path.write_bytes(b'\n'.join(lines) + b'\n')
+    refresh(path, cache_dir)
+
+    if rewrite == 'edited':
+        # Same length, so only the fingerprint tells the files apart
+        data = (b'\n'.join(lines) + b'\n').replace(b'Instagram', b'Snapchat!', 1)
+    else:
+        data = b'\n'.join(lines[:20]) + b'\n'
+    path.write_bytes(data)
+
+    assert summary(refresh(path, cache_dir)) == summary(rebuilt(tmp_path, data))
@@ -0,0 +1,27 @@
+import io
+
+import pytest
+
+from loader import BACKENDS, read_social_media
+
+HEADER = ('User_ID,Age,Gender,Platform,Daily_Usage_Time (minutes),Posts_Per_Day,Likes_Received_Per_Day,'
+          'Comments_Received_Per_Day,Messages_Sent_Per_Day,Dominant_Emotion\n')
+
+# A complete row, then one still being written when the file was read
+DATA = (HEADER + '1,25,Female,Instagram,120,3,40,2,4,Happiness\n' + '9999,30,Male,Twitter,60,2,').encode()
+
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_short_rows_are_read_from_file_objects(backend):
+    df = read_social_media(io.BytesIO(DATA), backend=backend)
+
+    assert df['User_ID'].tolist() == [1, 9999]
+    assert df['Likes_Received_Per_Day'].isna().tolist() == [False, True]
+
+
+def test_backends_agree_on_short_rows(tmp_path):
+    path = tmp_path / 'usage.csv'
+    path.write_bytes(DATA)
+    frames = [read_social_media(str(path), backend=backend) for backend in BACKENDS]
+
+    assert all(df.equals(frames[0]) for df in frames[1:])
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import parallel
+from parallel import parallel_groupby
+
+pytestmark = pytest.mark.skipif(parallel.start_method() is None, reason='needs fork')
+
+ROWS = 5_000
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    platform = pd.Categorical(rng.choice(['Instagram', 'Twitter', 'Facebook', None], ROWS))
+    return pd.DataFrame({
+        'Platform': platform,
+        'Gender': pd.array(rng.choice(['Female', 'Male', 'Non-binary', None], ROWS), dtype='str'),
+        'Age': pd.array(np.where(rng.random(ROWS) < 0.05, None, rng.integers(18, 60, ROWS)), dtype='Int64'),
+        'User_ID': rng.integers(0, 500, ROWS),
+        'Likes': rng.integers(0, 200, ROWS).astype('uint16'),
+        'Usage': np.where(rng.random(ROWS) < 0.05, np.nan, rng.random(ROWS) * 100),
+    })
+
+
+@pytest.fixture(autouse=True)
+def small_frames(monkeypatch):
+    monkeypatch.setattr(parallel, 'PARALLEL_MIN_ROWS', 0)
+
+
+COMBINED = {'likes': ('Likes', 'sum'), 'rows': ('Likes', 'size'), 'usage': ('Usage', 'count'),
+            'youngest': ('Age', 'min'), 'oldest': ('Age', 'max'), 'most_used': ('Usage', 'max'),
+            'first_gender': ('Gender', 'min')}
+
+
+@pytest.mark.parametrize('keys', [['Platform'], ['Platform', 'Gender'], ['Gender', 'Age']])
+@pytest.mark.parametrize('dropna', [True, False])
+@pytest.mark.parametrize('named', [COMBINED, dict(COMBINED, users=('User_ID', 'nunique'))],
+                         ids=['combined', 'shuffled'])
+@pytest.mark.parametrize('workers', [2, 3])
+def test_matches_the_serial_groupby(df, keys, dropna, named, workers):
+    expected = df.groupby(keys, observed=True, dropna=dropna).agg(**named)
+
+    pd.testing.assert_frame_equal(parallel_groupby(df, keys, named, workers, dropna), expected)
+
+
+def test_shared_memory_is_released(df, monkeypatch):
+    created = []
+    shared_array = parallel._shared_array
+
+    def tracked(length, dtype, owned):
+        attached = shared_array(length, dtype, owned)
+        created.append(attached[0])
+        return attached
+
+    monkeypatch.setattr(parallel, '_shared_array', tracked)
+    parallel_groupby(df, ['Platform'], {'users': ('User_ID', 'nunique')}, workers=2)
+
+    assert created
+    for name in created:
+        with pytest.raises(FileNotFoundError):
+            parallel.shared_memory.SharedMemory(name=name)
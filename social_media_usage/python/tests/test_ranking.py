@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ranking import PagedTable
+
+ORDER = [('Likes', False), ('Messages', False)]
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    size = 200
+    return pd.DataFrame({
+        'Platform': pd.Categorical(rng.choice(['Instagram', 'Twitter', 'Facebook'], size)),
+        'Likes': rng.integers(0, 5, size),
+        'Messages': rng.integers(0, 3, size),
+    })
+
+
+# What the browser showed: a stable sort of the frame sorted in the default order
+def client_sorted(df, sort_by):
+    ranked = df.sort_values([column for column, _ in ORDER], ascending=[ascending for _, ascending in ORDER],
+                            kind='stable')
+    if sort_by:
+        ranked = ranked.sort_values([column for column, _ in sort_by],
+                                    ascending=[ascending for _, ascending in sort_by], kind='stable')
+    return ranked.reset_index(drop=True)
+
+
+@pytest.mark.parametrize('sort_by', [[], [('Platform', True)], [('Likes', True)], [('Messages', False)]])
+def test_pages_follow_the_default_order_without_sorting_the_frame(df, sort_by):
+    table = PagedTable(df, order=ORDER)
+    expected = client_sorted(df, sort_by)
+
+    for page in (0, 3, 19):
+        rows = table.page(page, 10, sort_by).reset_index(drop=True)
+        assert rows.equals(expected.iloc[page * 10:page * 10 + 10].reset_index(drop=True))
+    assert table.df.equals(df)
+
+
+def test_subsets_keep_the_default_order(df):
+    table = PagedTable(df, order=ORDER).where('instagram', lambda df: df['Platform'] == 'Instagram')
+    expected = client_sorted(df[df['Platform'] == 'Instagram'], [])
+
+    assert table.page(1, 10).reset_index(drop=True).equals(expected.iloc[10:20].reset_index(drop=True))
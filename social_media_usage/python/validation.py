@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+from normalization import fold
+
+# Rule severities: rows failing a 'reject' rule are quarantined, 'warn' rules are only
+# counted, for values the cleaning steps repair
+REJECT = 'reject'
+WARN = 'warn'
+
+
+# A data quality rule. violations(df) returns a boolean numpy mask of the rows breaking
+# it, computed over whole columns so validation never runs Python code per row
+class Rule:
+    def __init__(self, name, columns, severity=WARN):
+        if severity not in (REJECT, WARN):
+            raise ValueError(f'Unknown severity {severity!r}, expected {REJECT} or {WARN}')
+        self.name = name
+        self.columns = list(columns)
+        self.severity = severity
+
+    def violations(self, df):
+        raise NotImplementedError
+
+
+# Values outside [low, high], either bound optional. Values that are not numbers are
+# left to IsInteger, missing values to NotNull
+class Range(Rule):
+    def __init__(self, name, column, low=None, high=None, severity=WARN):
+        super().__init__(name, [column], severity)
+        self.low = low
+        self.high = high
+
+    def violations(self, df):
+        values = pd.to_numeric(df[self.columns[0]], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        # Comparisons against NaN are False, so non-numbers never count as out of range
+        mask = np.zeros(len(values), dtype=bool)
+        if self.low is not None:
+            mask |= values < self.low
+        if self.high is not None:
+            mask |= values > self.high
+        return mask
+
+
+# Counters can't go below zero
+class NonNegative(Range):
+    def __init__(self, name, column, severity=WARN):
+        super().__init__(name, column, low=0, severity=severity)
+
+
+# Values not in an allowed set, optionally ignoring case and whitespace. Membership is
+# decided once per distinct value and gathered back onto the rows
+class OneOf(Rule):
+    def __init__(self, name, column, values, fold_values=False, severity=WARN):
+        super().__init__(name, [column], severity)
+        self.fold_values = fold_values
+        self.allowed = {self._key(value) for value in values}
+
+    def _key(self, value):
+        return fold(value) if self.fold_values else value
+
+    def violations(self, df):
+        codes, uniques = pd.factorize(df[self.columns[0]])
+        bad = np.array([self._key(value) not in self.allowed for value in uniques] + [False], dtype=bool)
+        # Missing values have code -1, which picks the trailing False
+        return bad[codes]
+
+
+# Missing values
+class NotNull(Rule):
+    def __init__(self, name, column, severity=WARN):
+        super().__init__(name, [column], severity)
+
+    def violations(self, df):
+        return df[self.columns[0]].isna().to_numpy()
+
+
+# Values that are not whole numbers, whether stored as numbers or as text
+class IsInteger(Rule):
+    def __init__(self, name, column, severity=WARN):
+        super().__init__(name, [column], severity)
+
+    def violations(self, df):
+        column = df[self.columns[0]]
+        if pd.api.types.is_integer_dtype(column.dtype):
+            return np.zeros(len(column), dtype=bool)
+        values = pd.to_numeric(column, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        return column.notna().to_numpy() & ~(np.isfinite(values) & (values == np.trunc(values)))
+
+
+# Any other rule, usually across several columns: check(df) returns the violation mask
+class Check(Rule):
+    def __init__(self, name, columns, check, severity=WARN):
+        super().__init__(name, columns, severity)
+        self.check = check
+
+    def violations(self, df):
+        return np.asarray(self.check(df), dtype=bool)
+
+
+# Outcome of validating one frame: the rows kept, the rows quarantined with the reject
+# rules they failed, and the number of violations of every rule
+class ValidationResult:
+    def __init__(self, valid, rejected, counts):
+        self.valid = valid
+        self.rejected = rejected
+        self.counts = counts
+
+
+# A set of rules checked together
+class Validator:
+    def __init__(self, rules):
+        names = [rule.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise ValueError('Rule names must be unique')
+        self.rules = list(rules)
+
+    def validate(self, df):
+        counts = {}
+        rejected = np.zeros(len(df), dtype=bool)
+        failed = []
+        for rule in self.rules:
+            mask = rule.violations(df)
+            counts[rule.name] = int(mask.sum())
+            if rule.severity == REJECT and counts[rule.name]:
+                rejected |= mask
+                failed.append((rule.name, mask))
+
+        counts = pd.DataFrame({
+            'severity': [rule.severity for rule in self.rules],
+            'violations': pd.Series(counts, dtype='int64').to_numpy(),
+        }, index=pd.Index([rule.name for rule in self.rules], name='rule'))
+
+        if not rejected.any():
+            return ValidationResult(df, df.iloc[:0].assign(Failed_Rules=pd.Series(dtype=object)), counts)
+
+        # Name the failed rules only for the quarantined rows, which are few
+        reasons = np.full(int(rejected.sum()), '', dtype=object)
+        for name, mask in failed:
+            hit = mask[rejected]
+            reasons[hit] = reasons[hit] + np.where(reasons[hit] == '', name, ',' + name)
+        quarantine = df[rejected].assign(Failed_Rules=reasons)
+        return ValidationResult(df[~rejected], quarantine, counts)
+
+
+# Violation counts and quarantined rows accumulated over every validated frame, e.g.
+# one per chunk or per appended delta
+class ValidationReport:
+    def __init__(self):
+        self.rows_checked = 0
+        self.counts = None
+        self.rejected = []
+
+    def add(self, result):
+        self.rows_checked += len(result.valid) + len(result.rejected)
+        if self.counts is None:
+            self.counts = result.counts.copy()
+        else:
+            self.counts['violations'] += result.counts['violations']
+        if len(result.rejected):
+            self.rejected.append(result.rejected)
+
+    @property
+    def quarantine(self):
+        if not self.rejected:
+            return pd.DataFrame(columns=['Failed_Rules'])
+        return pd.concat(self.rejected)
+
+    def write_quarantine(self, path):
+        self.quarantine.to_csv(path, index=False)
+
+
+def format_validation_report(report):
+    if report.counts is None:
+        return 'No rows validated'
+    broken = report.counts[report.counts['violations'] > 0]
+    details = ', '.join(f"{name} {row['violations']}" for name, row in broken.iterrows())
+    quarantined = sum(len(rejected) for rejected in report.rejected)
+    return (f"Validated {report.rows_checked} rows, quarantined {quarantined}"
+            + (f"; violations: {details}" if details else ''))